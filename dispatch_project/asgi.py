@@ -2,6 +2,8 @@
 ASGI config for dispatch_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn dispatch_project.asgi:application``)
+to enable the dashboard's live updates stream.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -24,26 +24,62 @@ class NotifierConfig(AppConfig):
 
         try:
             from apscheduler.schedulers.background import BackgroundScheduler
+            from apscheduler.jobstores.memory import MemoryJobStore
             from apscheduler.triggers.interval import IntervalTrigger
             from django_apscheduler.jobstores import DjangoJobStore, register_events, register_job
-            from notifier.jobs import scheduled_dispatch_job
+            from notifier.jobs import (
+                DISPATCH_JOB_ID, POLL_INTERVAL_SECONDS, flush_delivery_reports_job,
+                scheduled_dispatch_job, set_scheduler, worker_heartbeat_job,
+            )
+            from notifier.sharding import SHARDING_ENABLED, WORKER_HEARTBEAT_SECONDS, WORKER_ID
+            from notifier.delivery_reports import DELIVERY_REPORT_FLUSH_SECONDS
 
             scheduler = BackgroundScheduler()
             scheduler.add_jobstore(DjangoJobStore(), "default")
 
+            # The Django job store is shared by all workers and APScheduler does not support
+            # several schedulers on one persistent store, so sharded workers keep their jobs in memory
+            jobstore = "default"
+            if SHARDING_ENABLED:
+                scheduler.add_jobstore(MemoryJobStore(), "local")
+                jobstore = "local"
+
             # Schedule the job
             scheduler.add_job(
                 scheduled_dispatch_job,
-                trigger=IntervalTrigger(minutes=1),
-                id="dispatch_notification_job",
+                trigger=IntervalTrigger(seconds=POLL_INTERVAL_SECONDS),
+                id=DISPATCH_JOB_ID,
                 name="Dispatch Notification Job",
+                jobstore=jobstore,
                 replace_existing=True,
             )
 
+            # Apply stored SMS delivery reports, including those left over by a restart
+            scheduler.add_job(
+                flush_delivery_reports_job,
+                trigger=IntervalTrigger(seconds=DELIVERY_REPORT_FLUSH_SECONDS),
+                id="flush_delivery_reports_job",
+                name="Flush SMS Delivery Reports",
+                jobstore=jobstore,
+                replace_existing=True,
+            )
+
+            # Keep this worker's partitions while it is idle between dispatch runs
+            if SHARDING_ENABLED:
+                scheduler.add_job(
+                    worker_heartbeat_job,
+                    trigger=IntervalTrigger(seconds=WORKER_HEARTBEAT_SECONDS),
+                    id="worker_heartbeat_job",
+                    name=f"Sharding Worker Heartbeat ({WORKER_ID})",
+                    jobstore="local",
+                    replace_existing=True,
+                )
+
             register_events(scheduler)
             scheduler.start()
+            set_scheduler(scheduler)
 
-            logger.info("✅ APScheduler started: dispatch notification job scheduled every 1 minutes")
+            logger.info("✅ APScheduler started: dispatch notification job scheduled every %s seconds", POLL_INTERVAL_SECONDS)
 
         except Exception as e:
             logger.error("❌ Failed to start APScheduler: %s", str(e), exc_info=True)
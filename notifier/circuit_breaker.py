@@ -0,0 +1,97 @@
+import threading
+import time
+from decouple import config
+
+# A dependency's breaker opens after this many consecutive failures
+CIRCUIT_FAILURE_THRESHOLD = config("CIRCUIT_FAILURE_THRESHOLD", default=5, cast=int)
+# and lets a probe request through again after this many seconds
+CIRCUIT_RECOVERY_SECONDS = config("CIRCUIT_RECOVERY_SECONDS", default=60, cast=int)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency while its circuit breaker rejects calls.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency is down instead of waiting for every call to time out.
+
+    closed: calls go through, consecutive failures are counted.
+    open: calls are rejected until the recovery timeout has passed.
+    half_open: a single probe call is let through; its outcome closes or reopens the breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, recovery_timeout=CIRCUIT_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """
+        Returns True while calls would be rejected, without using up the half-open probe.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.recovery_timeout
+            if self.state == self.HALF_OPEN:
+                return self._probe_in_flight
+            return False
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def _transition(self, state):
+        print(f"[CircuitBreaker] {self.name}: {self.state} -> {state} ({self.failures} consecutive failures)", flush=True)
+        self.state = state
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """
+    Returns the process-wide breaker for a dependency, creating it on first use.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
@@ -0,0 +1,109 @@
+import threading
+import traceback
+from decouple import config
+from django.db import connections, transaction
+from django.utils import timezone
+from notifier.models import NotifiedDelivery, SmsDeliveryReport
+
+# Stored reports are applied once this many are pending or this many seconds after the first one
+DELIVERY_REPORT_BATCH_SIZE = config("DELIVERY_REPORT_BATCH_SIZE", default=500, cast=int)
+DELIVERY_REPORT_FLUSH_SECONDS = config("DELIVERY_REPORT_FLUSH_SECONDS", default=5, cast=int)
+# Shared secret the gateway must send as ?token=... on the callback URL; callbacks are refused if empty
+SMS_CALLBACK_TOKEN = config("SMS_CALLBACK_TOKEN", default="")
+
+# Reports stored by this process since its last flush, and the timer that flushes them when callbacks go quiet
+_pending_count = 0
+_flush_timer = None
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+
+def store_delivery_reports(reports):
+    """
+    Saves received delivery reports to SmsDeliveryReport in one insert so that none are lost
+    on a restart, and applies the stored reports once enough are pending or after
+    DELIVERY_REPORT_FLUSH_SECONDS.
+
+    Args:
+        reports (list): (message id, status) pairs in the order they were received.
+    """
+    global _pending_count, _flush_timer
+
+    if not reports:
+        return
+
+    SmsDeliveryReport.objects.bulk_create([
+        SmsDeliveryReport(message_id=message_id, status=status) for message_id, status in reports
+    ])
+
+    with _lock:
+        _pending_count += len(reports)
+        due = _pending_count >= DELIVERY_REPORT_BATCH_SIZE
+        if not due and _flush_timer is None:
+            _flush_timer = threading.Timer(DELIVERY_REPORT_FLUSH_SECONDS, _timed_flush)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+    if due:
+        flush_delivery_reports()
+
+
+def _timed_flush():
+    global _flush_timer
+
+    with _lock:
+        _flush_timer = None
+    try:
+        flush_delivery_reports()
+    finally:
+        connections.close_all()
+
+
+def flush_delivery_reports():
+    """
+    Applies the stored delivery reports to NotifiedDelivery in batches of
+    DELIVERY_REPORT_BATCH_SIZE, oldest first, and deletes them once applied.
+    Reports that fail to apply stay stored for the next flush.
+
+    Returns:
+        int: The number of NotifiedDelivery rows updated.
+    """
+    global _pending_count
+
+    with _lock:
+        _pending_count = 0
+
+    applied = 0
+    updated = 0
+    with _flush_lock:
+        try:
+            while True:
+                batch = list(
+                    SmsDeliveryReport.objects.order_by('id')
+                    .values_list('id', 'message_id', 'status')[:DELIVERY_REPORT_BATCH_SIZE]
+                )
+                if not batch:
+                    break
+
+                # A newer report for the same message replaces the older one
+                reports = {message_id: status for _, message_id, status in batch}
+                now = timezone.now()
+                rows = list(
+                    NotifiedDelivery.objects.filter(sms_message_id__in=list(reports)).only('id', 'sms_message_id')
+                )
+                for row in rows:
+                    row.sms_status = reports[row.sms_message_id]
+                    row.sms_status_updated_at = now
+                    row.updated_at = now
+
+                with transaction.atomic():
+                    NotifiedDelivery.objects.bulk_update(rows, ['sms_status', 'sms_status_updated_at', 'updated_at'])
+                    SmsDeliveryReport.objects.filter(id__in=[report_id for report_id, _, _ in batch]).delete()
+                applied += len(batch)
+                updated += len(rows)
+        except Exception:
+            print("[SMS ERROR] Failed to apply delivery reports:\n", traceback.format_exc(), flush=True)
+
+    if applied:
+        print(f"[SMS] Applied {applied} delivery reports to {updated} notifications", flush=True)
+    return updated
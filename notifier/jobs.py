@@ -1,5 +1,154 @@
+import threading
+from decouple import config
+from django.db import connections
+from notifier.management.commands.send_dispatch_notifications import (
+    ERP_PREFETCH, run_dispatch_notification_job, send_pending_cc_digest, start_customer_prefetch,
+)
+from notifier.management.commands.emails import CC_DIGEST
+from notifier.delivery_reports import flush_delivery_reports
+from notifier.sharding import SHARDING_ENABLED, heartbeat, is_leader
 
-from notifier.management.commands.send_dispatch_notifications import run_dispatch_notification_job
+DISPATCH_JOB_ID = "dispatch_notification_job"
 
-def scheduled_dispatch_job():
-    run_dispatch_notification_job()
\ No newline at end of file
+# Adaptive polling: back off while ticks find nothing new, tighten while new deliveries keep coming
+ADAPTIVE_POLLING = config("ADAPTIVE_POLLING", default=False, cast=bool)
+POLL_INTERVAL_SECONDS = config("POLL_INTERVAL_SECONDS", default=60, cast=int)
+POLL_MIN_INTERVAL_SECONDS = config("POLL_MIN_INTERVAL_SECONDS", default=15, cast=int)
+POLL_MAX_INTERVAL_SECONDS = config("POLL_MAX_INTERVAL_SECONDS", default=600, cast=int)
+POLL_BACKOFF_FACTOR = config("POLL_BACKOFF_FACTOR", default=2.0, cast=float)
+
+# Webhook triggered runs wait this long so that a burst of calls results in one run
+HANSA_WEBHOOK_DEBOUNCE_SECONDS = config("HANSA_WEBHOOK_DEBOUNCE_SECONDS", default=5, cast=float)
+
+
+class AdaptivePollingPolicy:
+    """
+    Works out the next polling interval from how many new deliveries the last run found.
+    """
+
+    def __init__(self, initial, minimum, maximum, factor):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.interval = min(max(initial, minimum), maximum)
+
+    def next_interval(self, new_deliveries):
+        if new_deliveries:
+            interval = self.interval / self.factor
+        else:
+            interval = self.interval * self.factor
+        self.interval = int(min(max(interval, self.minimum), self.maximum))
+        return self.interval
+
+
+polling_policy = AdaptivePollingPolicy(
+    POLL_INTERVAL_SECONDS, POLL_MIN_INTERVAL_SECONDS, POLL_MAX_INTERVAL_SECONDS, POLL_BACKOFF_FACTOR
+)
+
+_scheduler = None
+_run_lock = threading.Lock()
+_rerun_lock = threading.Lock()
+_rerun_requested = False
+_debounce_lock = threading.Lock()
+_debounce_timer = None
+
+
+def set_scheduler(scheduler):
+    global _scheduler
+    _scheduler = scheduler
+
+
+def scheduled_dispatch_job(rerun_if_busy=False):
+    """
+    Runs the dispatch job unless a run is already in progress. With rerun_if_busy,
+    a busy run is asked to go once more when it finishes, since it may have fetched
+    Hansa before the delivery that triggered this call existed.
+    """
+    global _rerun_requested
+
+    # Scheduled and webhook triggered runs must not overlap
+    with _rerun_lock:
+        if not _run_lock.acquire(blocking=False):
+            if rerun_if_busy:
+                _rerun_requested = True
+                print("Dispatch run already in progress, running again once it finishes.", flush=True)
+            else:
+                print("Dispatch run already in progress, skipping.", flush=True)
+            return
+
+    new_deliveries = 0
+    try:
+        while True:
+            with _rerun_lock:
+                _rerun_requested = False
+
+            new_deliveries += run_dispatch_notification_job()
+            # Sharded workers share the notifications table, only one of them sends the digest
+            if CC_DIGEST and (not SHARDING_ENABLED or is_leader()):
+                send_pending_cc_digest()
+
+            with _rerun_lock:
+                if not _rerun_requested:
+                    _run_lock.release()
+                    break
+    except Exception:
+        _run_lock.release()
+        raise
+
+    # Use the idle time until the next run to download its customer directory
+    if ERP_PREFETCH:
+        start_customer_prefetch()
+
+    if ADAPTIVE_POLLING:
+        adjust_polling_interval(new_deliveries)
+
+
+def adjust_polling_interval(new_deliveries):
+    previous = polling_policy.interval
+    interval = polling_policy.next_interval(new_deliveries)
+    if interval == previous or _scheduler is None:
+        return
+
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    _scheduler.reschedule_job(DISPATCH_JOB_ID, trigger=IntervalTrigger(seconds=interval))
+    print(f"Polling interval changed from {previous}s to {interval}s", flush=True)
+
+
+def request_dispatch_run():
+    """
+    Schedules a dispatch run after HANSA_WEBHOOK_DEBOUNCE_SECONDS unless one is already pending.
+
+    Returns:
+        bool: True if a new run was scheduled, False if it was merged into a pending one.
+    """
+    global _debounce_timer
+
+    with _debounce_lock:
+        if _debounce_timer is not None:
+            return False
+        _debounce_timer = threading.Timer(HANSA_WEBHOOK_DEBOUNCE_SECONDS, _triggered_dispatch_run)
+        _debounce_timer.daemon = True
+        _debounce_timer.start()
+        return True
+
+
+def _triggered_dispatch_run():
+    global _debounce_timer
+
+    with _debounce_lock:
+        _debounce_timer = None
+
+    try:
+        scheduled_dispatch_job(rerun_if_busy=True)
+    except Exception as e:
+        print(f"Error in webhook triggered dispatch run: {e}", flush=True)
+    finally:
+        connections.close_all()
+
+
+def flush_delivery_reports_job():
+    flush_delivery_reports()
+
+def worker_heartbeat_job():
+    heartbeat()
\ No newline at end of file
@@ -0,0 +1,91 @@
+import asyncio
+from datetime import timedelta
+from decouple import config
+from django.core.handlers.asgi import ASGIRequest
+from django.utils import timezone
+from notifier.models import NotifiedDelivery
+
+# How often the database is checked for new or changed notifications, once per process
+LIVE_UPDATES_POLL_SECONDS = config("LIVE_UPDATES_POLL_SECONDS", default=2, cast=float)
+LIVE_UPDATES_KEEPALIVE_SECONDS = config("LIVE_UPDATES_KEEPALIVE_SECONDS", default=15, cast=float)
+# updated_at is set before the row is committed, so each poll looks back this far for late commits
+LIVE_UPDATES_OVERLAP_SECONDS = config("LIVE_UPDATES_OVERLAP_SECONDS", default=5, cast=float)
+# Forces the stream on even when the request did not come through the ASGI application
+LIVE_UPDATES_ENABLED = config("LIVE_UPDATES_ENABLED", default=False, cast=bool)
+
+
+def live_updates_available(request):
+    # Under WSGI (waitress, runserver) a streaming response would hold a worker thread forever
+    return LIVE_UPDATES_ENABLED or isinstance(request, ASGIRequest)
+
+
+def serialize_delivery(d):
+    return {
+        'id': d.pk,
+        'order_number': d.order_number,
+        'customer_name': d.customer_name or 'Unknown',
+        'dispatch_date': d.dispatch_date.strftime('%Y-%m-%d') if d.dispatch_date else '',
+        'email_sent': d.email_sent,
+        'sms_sent': d.sms_sent,
+        'sms_status': d.sms_status or '',
+        'notes': d.notes or '',
+        'created_at': timezone.localtime(d.created_at).strftime('%Y-%m-%d %H:%M'),
+    }
+
+
+class DeliveryBroadcaster:
+    """
+    Fans out new and changed NotifiedDelivery rows to every connected dashboard.
+    A single polling task per process does the database work, however many clients are connected.
+    """
+
+    def __init__(self, poll_interval=LIVE_UPDATES_POLL_SECONDS, overlap=LIVE_UPDATES_OVERLAP_SECONDS):
+        self.poll_interval = poll_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.subscribers = set()
+        self._task = None
+        self._last_seen = None
+        # (id, updated_at) of the changes already sent that are still inside the overlap window
+        self._sent = set()
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=100)
+        self.subscribers.add(queue)
+        if self._task is None or self._task.done():
+            # Clients that just loaded the page only need changes from now on
+            self._last_seen = timezone.now()
+            self._sent = set()
+            self._task = asyncio.get_running_loop().create_task(self._poll())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    async def _poll(self):
+        while self.subscribers:
+            await asyncio.sleep(self.poll_interval)
+            since = self._last_seen - self.overlap
+            try:
+                changed = [
+                    d async for d in NotifiedDelivery.objects.filter(updated_at__gte=since).order_by('updated_at')
+                ]
+            except Exception as e:
+                print(f"[Live updates] Failed to load changes: {e}", flush=True)
+                continue
+
+            self._sent = {(pk, updated_at) for pk, updated_at in self._sent if updated_at >= since}
+            for d in changed:
+                if (d.pk, d.updated_at) in self._sent:
+                    continue
+                self._sent.add((d.pk, d.updated_at))
+                self._last_seen = max(self._last_seen, d.updated_at)
+                event = serialize_delivery(d)
+                for queue in list(self.subscribers):
+                    try:
+                        queue.put_nowait(event)
+                    except asyncio.QueueFull:
+                        # A client that stopped reading is not allowed to hold up the others
+                        pass
+
+
+broadcaster = DeliveryBroadcaster()
@@ -2,6 +2,7 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from decouple import config, Csv
+from notifier.circuit_breaker import CircuitOpenError, get_breaker
 
 # Load configuration from .env
 EMAIL_HOST = config("EMAIL_HOST")
@@ -11,26 +12,54 @@ EMAIL_HOST_USER = config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 FROM_EMAIL = config("FROM_EMAIL")
 CC_EMAILS = config("CC_EMAILS", cast=Csv())
+# Send CC_EMAILS one periodic digest instead of copying them on every customer email
+CC_DIGEST = config("CC_DIGEST", default=False, cast=bool)
+CC_DIGEST_INTERVAL_MINUTES = config("CC_DIGEST_INTERVAL_MINUTES", default=0, cast=int)
+EMAIL_TIMEOUT_SECONDS = config("EMAIL_TIMEOUT_SECONDS", default=30, cast=int)
+
+smtp_breaker = get_breaker("smtp")
+
+def send_email(to_email, subject, body, cc=None):
+    """
+    Sends a plain text email.
+
+    Args:
+        to_email (str or list): The recipient address(es).
+        subject (str): The email subject.
+        body (str): The email body.
+        cc (list, optional): Addresses to copy. Defaults to CC_EMAILS unless CC_DIGEST is enabled.
+
+    Returns:
+        bool: True if the email was sent successfully, False otherwise.
+
+    Raises:
+        CircuitOpenError: If the SMTP circuit is open and nothing was attempted.
+    """
+    if cc is None:
+        cc = [] if CC_DIGEST else CC_EMAILS
+    to_emails = to_email if isinstance(to_email, list) else [to_email]
+    to_email = ', '.join(to_emails)
 
-def send_email(to_email, subject, body):
- 
     msg = MIMEMultipart()
     msg['From'] = FROM_EMAIL
     msg['To'] = to_email
     msg['Subject'] = subject
     
-    if CC_EMAILS:
-        msg['Cc'] = ', '.join(CC_EMAILS)
+    if cc:
+        msg['Cc'] = ', '.join(cc)
     
     msg.attach(MIMEText(body, 'plain'))
     
-    recipients = [to_email] + CC_EMAILS
+    recipients = to_emails + list(cc)
+
+    if not smtp_breaker.allow_request():
+        raise CircuitOpenError(f"SMTP circuit open, not sending to {to_email}")
 
     try:
         if EMAIL_PORT == 465:
-            server = smtplib.SMTP_SSL(EMAIL_HOST, EMAIL_PORT)
+            server = smtplib.SMTP_SSL(EMAIL_HOST, EMAIL_PORT, timeout=EMAIL_TIMEOUT_SECONDS)
         else:
-            server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
+            server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT, timeout=EMAIL_TIMEOUT_SECONDS)
             if EMAIL_USE_TLS:
                 server.starttls()
 
@@ -43,12 +72,19 @@ def send_email(to_email, subject, body):
         # Close the server connection
         server.quit()
 
+        smtp_breaker.record_success()
         print(f"[Email INFO] Successfully sent to {to_email}")
         return True
 
+    except smtplib.SMTPRecipientsRefused as e:
+        # The relay is up, only this address was rejected
+        smtp_breaker.record_success()
+        print(f"[Email ERROR] Recipients refused: {e}")
     except smtplib.SMTPException as e:
+        smtp_breaker.record_failure()
         print(f"[Email ERROR] SMTP error: {e}")
     except Exception as e:
+        smtp_breaker.record_failure()
         print(f"[Email ERROR] Failed to send email to {to_email}: {e}")
     finally:
         try:
@@ -58,4 +94,33 @@ def send_email(to_email, subject, body):
 
     return False
 
+def send_cc_digest(deliveries):
+    """
+    Sends CC_EMAILS a single summary of the given notified deliveries.
+
+    Args:
+        deliveries (list): NotifiedDelivery records to summarise.
+
+    Returns:
+        bool: True if the digest was sent successfully, False otherwise.
+
+    Raises:
+        CircuitOpenError: If the SMTP circuit is open.
+    """
+    if not CC_EMAILS or not deliveries:
+        return False
+
+    lines = []
+    for d in deliveries:
+        lines.append(
+            f"Order #{d.order_number} - {d.customer_name or 'Unknown'} - "
+            f"email: {'sent' if d.email_sent else 'not sent'} ({d.email or '-'}), "
+            f"sms: {'sent' if d.sms_sent else 'not sent'} ({d.phone_number or '-'})"
+        )
+
+    first = deliveries[0].created_at.strftime('%Y-%m-%d %H:%M')
+    last = deliveries[-1].created_at.strftime('%Y-%m-%d %H:%M')
+    subject = f"Dispatch Notifications Digest: {len(deliveries)} orders ({first} - {last})"
+    body = f"The following dispatch notifications were sent between {first} and {last}:\n\n" + "\n".join(lines)
 
+    return send_email(list(CC_EMAILS), subject, body, cc=[])
@@ -1,11 +1,31 @@
+import threading
+import time
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import xmltodict
 import requests
-from datetime import datetime
-from decouple import config
-from notifier.models import NotifiedDelivery
-from .emails import send_email
-from .sms import send_sms
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from decouple import config, Csv
+from django.db import transaction
+from notifier.models import NotifiedDelivery, NotifiedDeliveryLine
+from notifier.circuit_breaker import CircuitOpenError, get_breaker
+from notifier.phone_numbers import build_customer_directory
+from notifier.sharding import (
+    SHARDING_ENABLED, claim_pending_deliveries, live_workers, owned_partitions, partition_of,
+    release_claims, select_owned_deliveries,
+)
+from django.utils import timezone
+from .emails import send_email, send_cc_digest, smtp_breaker, CC_DIGEST, CC_DIGEST_INTERVAL_MINUTES, CC_EMAILS
+from .sms import send_sms, send_bulk_sms, sms_breaker, SMS_BULK_MODE, SMS_BULK_SEND_URL, SMS_BULK_UNKNOWN
+
+# sms_status values of bulk mode SMS until the gateway reports on them
+SMS_QUEUED = "queued"
+SMS_SUBMITTED = "submitted"
+SMS_REJECTED = "rejected"
+SMS_EXPIRED = "expired"
+SMS_UNKNOWN = "unknown"
 
 # Load configuration
 HANSA_API_URL = config("HANSA_API_URL")
@@ -13,16 +33,92 @@ HANSA_GET_CUSTOMER_API_URL = config("HANSA_GET_CUSTOMER_API_URL")
 HANSA_USERNAME = config("HANSA_USERNAME")
 HANSA_PASSWORD = config("HANSA_PASSWORD")
 CONTACT_PHONE = config("CONTACT_PHONE")
+# Send one combined email/SMS per recipient for all of a run's new deliveries
+NOTIFICATION_COALESCE = config("NOTIFICATION_COALESCE", default=False, cast=bool)
+HANSA_TIMEOUT_SECONDS = config("HANSA_TIMEOUT_SECONDS", default=60, cast=int)
+# Download the customer directory for the next run in the background once a run is done
+ERP_PREFETCH = config("ERP_PREFETCH", default=False, cast=bool)
+ERP_PREFETCH_MAX_AGE_SECONDS = config("ERP_PREFETCH_MAX_AGE_SECONDS", default=300, cast=int)
+# Bulk mode SMS that could not be submitted are retried on later runs for this long
+SMS_RETRY_MAX_AGE_HOURS = config("SMS_RETRY_MAX_AGE_HOURS", default=12, cast=int)
+
+# Delivery filters, sent to Hansa as filter.<Field> query parameters and re-checked locally.
+# PlanSendDate must fall between today minus DAYS_BACK and today plus DAYS_AHEAD (disabled if DAYS_BACK is -1).
+HANSA_FILTER_DAYS_BACK = config("HANSA_FILTER_DAYS_BACK", default=-1, cast=int)
+HANSA_FILTER_DAYS_AHEAD = config("HANSA_FILTER_DAYS_AHEAD", default=0, cast=int)
+HANSA_FILTER_STATUS = config("HANSA_FILTER_STATUS", default="", cast=Csv())
+HANSA_FILTER_LOCATION = config("HANSA_FILTER_LOCATION", default="", cast=Csv())
+HANSA_FILTER_SERVICE_TYPE = config("HANSA_FILTER_SERVICE_TYPE", default="", cast=Csv())
+
+hansa_breaker = get_breaker("hansa")
+
+def get_plan_send_date_range():
+    if HANSA_FILTER_DAYS_BACK < 0:
+        return None
+    today = date.today()
+    return today - timedelta(days=HANSA_FILTER_DAYS_BACK), today + timedelta(days=HANSA_FILTER_DAYS_AHEAD)
+
+def get_value_filters():
+    return {
+        'Status': HANSA_FILTER_STATUS,
+        'Location': HANSA_FILTER_LOCATION,
+        'ServiceType': HANSA_FILTER_SERVICE_TYPE,
+    }
+
+def get_delivery_query_params():
+    """
+    Builds the Hansa REST filter parameters for the configured delivery filters.
+    Hansa filters a field on a single value or a from:to range, so fields allowing
+    several values are only filtered locally.
+    """
+    params = {}
+
+    date_range = get_plan_send_date_range()
+    if date_range:
+        date_from, date_to = date_range
+        params['filter.PlanSendDate'] = f"{date_from:%Y-%m-%d}:{date_to:%Y-%m-%d}"
+
+    for field, values in get_value_filters().items():
+        if len(values) == 1:
+            params[f'filter.{field}'] = values[0]
+
+    return params
+
+def delivery_matches_filters(delivery):
+    date_range = get_plan_send_date_range()
+    if date_range:
+        try:
+            plan_send_date = datetime.strptime(delivery.get('PlanSendDate') or '', '%Y-%m-%d').date()
+        except ValueError:
+            return False
+        if not date_range[0] <= plan_send_date <= date_range[1]:
+            return False
+
+    for field, values in get_value_filters().items():
+        if values and delivery.get(field) not in values:
+            return False
+
+    return True
+
 def get_deliveries():
+    if not hansa_breaker.allow_request():
+        print("Hansa circuit open, not fetching deliveries.", flush=True)
+        return []
+
     try:
-        response = requests.get(HANSA_API_URL, auth=(HANSA_USERNAME, HANSA_PASSWORD))
+        params = get_delivery_query_params()
+        response = requests.get(
+            HANSA_API_URL, params=params, auth=(HANSA_USERNAME, HANSA_PASSWORD), timeout=HANSA_TIMEOUT_SECONDS
+        )
         response.raise_for_status()
         deliveries_xml = xmltodict.parse(response.text)
+        hansa_breaker.record_success()
 
         # DEBUG: print top-level keys to verify structure
         print(f"Deliveries XML root keys: {list(deliveries_xml.keys())}", flush=True)
 
     except Exception as e:
+        hansa_breaker.record_failure()
         print(f"Error fetching deliveries: {e}", flush=True)
         return []
 
@@ -41,8 +137,13 @@ def get_deliveries():
     if isinstance(shvc_entries, dict):
         shvc_entries = [shvc_entries]
 
-    print(f"Found {len(shvc_entries)} deliveries", flush=True)
-    return shvc_entries
+    # Safety net in case the server ignored any of the filters
+    matching = [d for d in shvc_entries if delivery_matches_filters(d)]
+    if len(matching) != len(shvc_entries):
+        print(f"Filtered out {len(shvc_entries) - len(matching)} deliveries not matching {params}", flush=True)
+
+    print(f"Found {len(matching)} deliveries", flush=True)
+    return matching
 
 # def get_deliveries():
 #     try:
@@ -70,98 +171,442 @@ def get_deliveries():
 #     return shvc_entries
 
 def fetch_all_customers():
+    if not hansa_breaker.allow_request():
+        print("Hansa circuit open, not fetching customers.", flush=True)
+        return []
+
     try:
-        response = requests.get(HANSA_GET_CUSTOMER_API_URL, auth=(HANSA_USERNAME, HANSA_PASSWORD))
+        response = requests.get(HANSA_GET_CUSTOMER_API_URL, auth=(HANSA_USERNAME, HANSA_PASSWORD), timeout=HANSA_TIMEOUT_SECONDS)
         response.raise_for_status()
         customers_data = xmltodict.parse(response.text)
+        hansa_breaker.record_success()
         return customers_data.get('data', {}).get('CUVc', [])
     except Exception:
+        hansa_breaker.record_failure()
         print("Error fetching customers:\n", traceback.format_exc(), flush=True)
         return []
 
-def get_customer_phone(customer_email, customers_data):
-    for customer in customers_data:
-        if str(customer.get('eMail', '')).strip().lower() == str(customer_email).strip().lower():
-            phone = customer.get('Phone') or customer.get('Mobile') or customer.get('AltPhone')
-            print(f"Phone found for {customer_email}: {phone}", flush=True)
-            return phone
-    print(f"No customer phone found for email: {customer_email}", flush=True)
+def get_customer_phone(customer_email, customer_directory):
+    phone = customer_directory.get(str(customer_email).strip().lower())
+    if phone:
+        print(f"Phone found for {customer_email}: {phone}", flush=True)
+        return phone
+    print(f"No valid customer phone found for email: {customer_email}", flush=True)
     return None
 
-def run_dispatch_notification_job():
+_prefetched_directory = None
+_prefetched_at = 0
+_prefetch_lock = threading.Lock()
+_prefetch_thread = None
+
+def prefetch_customer_directory():
+    global _prefetched_directory, _prefetched_at
+
     customers_data = fetch_all_customers()
     if not customers_data:
-        print("No customer data found.", flush=True)
         return
+    directory = build_customer_directory(customers_data)
+    with _prefetch_lock:
+        _prefetched_directory = directory
+        _prefetched_at = time.monotonic()
+
+def start_customer_prefetch():
+    """
+    Starts downloading the customer directory for the next run unless a download is already running.
+    """
+    global _prefetch_thread
+
+    with _prefetch_lock:
+        if _prefetch_thread is not None and _prefetch_thread.is_alive():
+            return
+        _prefetch_thread = threading.Thread(target=prefetch_customer_directory, name="erp-prefetch", daemon=True)
+        _prefetch_thread.start()
+
+def get_prefetched_customer_directory():
+    with _prefetch_lock:
+        if _prefetched_directory and time.monotonic() - _prefetched_at < ERP_PREFETCH_MAX_AGE_SECONDS:
+            return _prefetched_directory
+    return None
+
+def fetch_erp_data():
+    """
+    Fetches the customer directory and the deliveries from Hansa concurrently.
+    A fresh prefetched customer directory is used instead of downloading it again.
+
+    Returns:
+        tuple: The customer directory (None if no customers were found), the deliveries,
+        and whether the directory was prefetched.
+    """
+    customer_directory = get_prefetched_customer_directory()
+    prefetched = customer_directory is not None
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        deliveries_future = executor.submit(get_deliveries)
+        customers_future = None if prefetched else executor.submit(fetch_all_customers)
+        deliveries = deliveries_future.result()
+        customers_data = customers_future.result() if customers_future else None
+
+    if not prefetched and customers_data:
+        customer_directory = build_customer_directory(customers_data)
+
+    return customer_directory, deliveries, prefetched
+
+def parse_dispatch_date(dispatch_date_str, order_number):
+    if not dispatch_date_str:
+        return None
+    try:
+        return datetime.strptime(dispatch_date_str, '%Y-%m-%d').date()
+    except Exception:
+        print(f"Failed to parse dispatch date {dispatch_date_str} for order {order_number}", flush=True)
+        return None
+
+def collect_pending_deliveries(deliveries, customer_directory):
+    """
+    Filters out already notified orders and resolves the recipient of each remaining delivery.
+
+    Returns:
+        list: One dict per new delivery with the raw SHVc record and its recipient details.
+    """
+    order_numbers = [delivery.get('SerNr', 'N/A') for delivery in deliveries]
+    notified = set(
+        NotifiedDelivery.objects.filter(order_number__in=order_numbers).values_list('order_number', flat=True)
+    )
+
+    pending = []
+    for delivery in deliveries:
+        order_number = delivery.get('SerNr', 'N/A')
+        if order_number in notified:
+            print(f"Order {order_number} already notified, skipping.", flush=True)
+            continue
+        # Guard against the same order appearing twice in one feed
+        notified.add(order_number)
+
+        email = delivery.get('Addr1')
+        pending.append({
+            'delivery': delivery,
+            'order_number': order_number,
+            'email': email,
+            'phone': get_customer_phone(email, customer_directory) if email else None,
+        })
+    return pending
+
+def group_by_recipient(pending):
+    """
+    Groups pending deliveries so that each recipient (email/phone pair) gets one notification.
+    Deliveries without any contact details are kept on their own.
+    """
+    groups = {}
+    for entry in pending:
+        email = str(entry['email']).strip().lower() if entry['email'] else None
+        phone = entry['phone']
+        key = (email, phone) if (email or phone) else ('order', entry['order_number'])
+        groups.setdefault(key, []).append(entry)
+    return list(groups.values())
+
+def build_message(order_numbers):
+    if len(order_numbers) == 1:
+        order_number = order_numbers[0]
+        message = (
+            f"Your order #{order_number} has been dispatched and will arrive today. "
+            f"We will notify you right away if there are any delays."
+        )
+        subject = f"Your Order #{order_number} Has Been Dispatched"
+    else:
+        orders = ", ".join(f"#{order_number}" for order_number in order_numbers)
+        message = (
+            f"Your orders {orders} have been dispatched and will arrive today. "
+            f"We will notify you right away if there are any delays."
+        )
+        subject = f"Your {len(order_numbers)} Orders Have Been Dispatched"
+    return subject, message
+
+def get_delivery_rows(delivery):
+    rows = (delivery.get('rows') or {}).get('row')
+    if isinstance(rows, list):
+        return [row for row in rows if isinstance(row, dict)]
+    if isinstance(rows, dict):
+        return [rows]
+    return []
+
+def parse_quantity(value):
+    if not value:
+        return 0
+    try:
+        return int(Decimal(str(value)))
+    except (InvalidOperation, ValueError):
+        return 0
+
+def parse_decimal(value):
+    # Prices end up in DecimalField(max_digits=12, decimal_places=2); anything else is dropped
+    if value in (None, ''):
+        return None
+    try:
+        number = Decimal(str(value).strip()).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None
+    if not number.is_finite() or number.adjusted() >= 10:
+        return None
+    return number
+
+def build_notified_delivery(entry, email_sent, sms_sent, notes="", sms_message_id=None, sms_status=None):
+    delivery = entry['delivery']
+    order_number = entry['order_number']
+
+    # The first line is kept on the delivery itself, all lines go to NotifiedDeliveryLine
+    rows = get_delivery_rows(delivery)
+    row_data = rows[0] if rows else {}
+
+    return NotifiedDelivery(
+        order_number=order_number,
+        customer_name=delivery.get('Addr0', 'Unknown'),
+        dispatch_date=parse_dispatch_date(delivery.get('PlanSendDate'), order_number),
+        status=delivery.get('Status', '-'),
+        location=delivery.get('Location'),
+        reg_date=delivery.get('RegDate'),
+        reg_time=delivery.get('RegTime'),
+        plan_send_date=delivery.get('PlanSendDate'),
+        ship_date=delivery.get('ShipDate'),
+        service_type=delivery.get('ServiceType'),
+        spec=row_data.get('Spec'),
+        product_code=row_data.get('ArtCode'),
+        quantity_ordered=parse_quantity(row_data.get('Ordered')),
+        unit=row_data.get('UnitCode'),
+        price=parse_decimal(row_data.get('Price')),
+        base_price=parse_decimal(row_data.get('BasePrice')),
+        cost_account=delivery.get('CostAcc'),
+        email=entry['email'],
+        phone_number=entry['phone'],
+        email_sent=email_sent,
+        sms_sent=sms_sent,
+        sms_message_id=sms_message_id,
+        sms_status=sms_status,
+        notes=notes,
+        cc_digested=not CC_DIGEST
+    )
+
+def record_notified_deliveries(group, email_sent, sms_sent, notes="", sms_message_id=None, sms_status=None):
+    """
+    Stores a NotifiedDelivery per delivery of the group together with all of its order lines,
+    using one bulk insert for the deliveries and one for the lines in a single transaction.
+    """
+    records = [
+        build_notified_delivery(entry, email_sent, sms_sent, notes, sms_message_id, sms_status) for entry in group
+    ]
+
+    with transaction.atomic():
+        records = NotifiedDelivery.objects.bulk_create(records)
+        lines = [
+            NotifiedDeliveryLine(
+                delivery=record,
+                line_number=line_number,
+                product_code=row.get('ArtCode'),
+                spec=row.get('Spec'),
+                quantity_ordered=parse_quantity(row.get('Ordered')),
+                unit=row.get('UnitCode'),
+                price=parse_decimal(row.get('Price')),
+                base_price=parse_decimal(row.get('BasePrice')),
+            )
+            for record, entry in zip(records, group)
+            for line_number, row in enumerate(get_delivery_rows(entry['delivery']), start=1)
+        ]
+        NotifiedDeliveryLine.objects.bulk_create(lines, batch_size=500)
+
+    for record in records:
+        print(f"NotifiedDelivery created for order {record.order_number}", flush=True)
+
+def notify_group(group, sms_outbox=None):
+    """
+    Sends one email and one SMS for a group of deliveries going to the same recipient
+    and records every delivery of the group individually.
+    If a channel the group needs has an open circuit breaker, the group is not recorded
+    so that it is picked up again by a later run.
+    With an sms_outbox the SMS is queued there for bulk submission instead of sent right away.
+
+    Returns:
+        bool: True if the group was notified, False if it was left for a later run.
+    """
+    email = group[0]['email']
+    phone = group[0]['phone']
+    order_numbers = [entry['order_number'] for entry in group]
+
+    if (email and smtp_breaker.is_open()) or (phone and sms_breaker.is_open()):
+        print(f"Circuit open, leaving orders {', '.join(order_numbers)} for a later run.", flush=True)
+        return False
+
+    subject, message = build_message(order_numbers)
+
+    sms_message_id = str(uuid.uuid4()) if phone else None
+
+    try:
+        email_sent = send_email(email, subject, message) if email else False
+        sms_status = None
+        if phone and sms_outbox is not None:
+            sms_outbox.append({'phone_number': phone, 'message': message, 'message_id': sms_message_id})
+            sms_sent = False
+            sms_status = SMS_QUEUED
+        else:
+            sms_sent = send_sms(phone, message, message_id=sms_message_id) if phone else False
+    except CircuitOpenError as e:
+        # The breaker refused after the check above, e.g. another thread took the half-open probe
+        print(f"{e}, leaving orders {', '.join(order_numbers)} for a later run.", flush=True)
+        return False
+
+    notes = ""
+    if len(group) > 1:
+        notes = f"Sent as one combined notification for orders {', '.join(order_numbers)}"
+        print(f"Coalesced {len(group)} orders into one notification: {', '.join(order_numbers)}", flush=True)
+
+    record_notified_deliveries(group, email_sent, sms_sent, notes, sms_message_id, sms_status)
+    return True
+
+def run_dispatch_notification_job():
+    """
+    Notifies customers about new deliveries.
+
+    Returns:
+        int: The number of new deliveries found in this run.
+    """
+    if SMS_BULK_MODE and SMS_BULK_SEND_URL:
+        retry_queued_sms()
+
+    customer_directory, deliveries, prefetched = fetch_erp_data()
+    if not customer_directory:
+        print("No customer data found.", flush=True)
+        return 0
 
-    deliveries = get_deliveries()
     if not deliveries:
         print("No deliveries found.", flush=True)
-        return
+        return 0
+
+    if SHARDING_ENABLED:
+        deliveries = select_owned_deliveries(deliveries)
 
     print(f"Processing {len(deliveries)} deliveries", flush=True)
 
-    for delivery in deliveries:
+    pending = collect_pending_deliveries(deliveries, customer_directory)
+    if SHARDING_ENABLED:
+        pending = claim_pending_deliveries(pending)
+
+    # Customers created since the prefetch are not in the prefetched directory yet
+    if prefetched and any(
+        entry['email'] and str(entry['email']).strip().lower() not in customer_directory for entry in pending
+    ):
+        print("Unknown customer in new deliveries, reloading customer directory.", flush=True)
+        customers_data = fetch_all_customers()
+        if customers_data:
+            customer_directory = build_customer_directory(customers_data)
+            for entry in pending:
+                if entry['email']:
+                    entry['phone'] = get_customer_phone(entry['email'], customer_directory)
+
+    if NOTIFICATION_COALESCE:
+        groups = group_by_recipient(pending)
+    else:
+        groups = [[entry] for entry in pending]
+
+    sms_outbox = [] if SMS_BULK_MODE and SMS_BULK_SEND_URL else None
+
+    for group in groups:
+        recorded = False
         try:
-            order_number = delivery.get('SerNr', 'N/A')
-            if NotifiedDelivery.objects.filter(order_number=order_number).exists():
-                print(f"Order {order_number} already notified, skipping.", flush=True)
-                continue
-
-            customer_name = delivery.get('Addr0', 'Unknown')
-            dispatch_date_str = delivery.get('PlanSendDate')
-            dispatch_date = None
-            if dispatch_date_str:
-                try:
-                    dispatch_date = datetime.strptime(dispatch_date_str, '%Y-%m-%d').date()
-                except Exception:
-                    print(f"Failed to parse dispatch date {dispatch_date_str} for order {order_number}", flush=True)
-
-            email = delivery.get('Addr1')
-            phone = get_customer_phone(email, customers_data) if email else None
-
-            message = (
-                f"Your order #{order_number} has been dispatched and will arrive today. "
-                f"We will notify you right away if there are any delays."
-            )
-            subject = f"Your Order #{order_number} Has Been Dispatched"
-
-            email_sent = send_email(email, subject, message) if email else False
-            sms_sent = send_sms(phone, message) if phone else False
-
-            rows = delivery.get('rows', {}).get('row')
-            if isinstance(rows, list):
-                row_data = rows[0] if rows else {}
-            elif isinstance(rows, dict):
-                row_data = rows
-            else:
-                row_data = {}
-
-            NotifiedDelivery.objects.create(
-                order_number=order_number,
-                customer_name=customer_name,
-                dispatch_date=dispatch_date,
-                status=delivery.get('Status', '-'),
-                location=delivery.get('Location'),
-                reg_date=delivery.get('RegDate'),
-                reg_time=delivery.get('RegTime'),
-                plan_send_date=delivery.get('PlanSendDate'),
-                ship_date=delivery.get('ShipDate'),
-                service_type=delivery.get('ServiceType'),
-                spec=row_data.get('Spec'),
-                product_code=row_data.get('ArtCode'),
-                quantity_ordered=int(row_data.get('Ordered', '0')) if row_data.get('Ordered') else 0,
-                unit=row_data.get('UnitCode'),
-                price=row_data.get('Price'),
-                base_price=row_data.get('BasePrice'),
-                cost_account=delivery.get('CostAcc'),
-                email=email,
-                phone_number=phone,
-                email_sent=email_sent,
-                sms_sent=sms_sent,
-                notes=""
-            )
-            print(f"NotifiedDelivery created for order {order_number}", flush=True)
+            recorded = notify_group(group, sms_outbox)
         except Exception as e:
-            print(f"Error processing delivery {delivery.get('SerNr', 'N/A')}: {e}", flush=True)
+            order_numbers = ', '.join(entry['order_number'] for entry in group)
+            print(f"Error processing delivery {order_numbers}: {e}", flush=True)
             print(traceback.format_exc(), flush=True)
+
+        if SHARDING_ENABLED and not recorded:
+            release_claims([entry['order_number'] for entry in group])
+
+    if sms_outbox:
+        send_sms_outbox(sms_outbox)
+
+    return len(pending)
+
+def send_sms_outbox(sms_outbox):
+    """
+    Submits the queued SMS in batches and updates their deliveries with the result.
+    Messages that could not be submitted stay queued for retry_queued_sms(); messages
+    the gateway may have received are never sent again and wait for their delivery report.
+    """
+    results = send_bulk_sms(sms_outbox)
+    sent_ids = [message_id for message_id, sent in results.items() if sent is True]
+    rejected_ids = [message_id for message_id, sent in results.items() if sent is False]
+    unknown_ids = [message_id for message_id, sent in results.items() if sent == SMS_BULK_UNKNOWN]
+
+    now = timezone.now()
+    NotifiedDelivery.objects.filter(sms_message_id__in=sent_ids).update(
+        sms_sent=True, sms_status=SMS_SUBMITTED, updated_at=now
+    )
+    NotifiedDelivery.objects.filter(sms_message_id__in=rejected_ids).update(sms_status=SMS_REJECTED, updated_at=now)
+    NotifiedDelivery.objects.filter(sms_message_id__in=unknown_ids).update(sms_status=SMS_UNKNOWN, updated_at=now)
+    print(
+        f"Bulk SMS: {len(sent_ids)}/{len(sms_outbox)} messages accepted, {len(rejected_ids)} rejected, "
+        f"{len(unknown_ids)} unknown, {len(sms_outbox) - len(sent_ids) - len(rejected_ids) - len(unknown_ids)} left queued",
+        flush=True,
+    )
+
+def retry_queued_sms():
+    """
+    Submits again the bulk mode SMS of earlier runs that could not be submitted.
+    Sharded workers only retry the messages whose first order is in one of their partitions.
+    """
+    cutoff = timezone.now() - timedelta(hours=SMS_RETRY_MAX_AGE_HOURS)
+    queued = NotifiedDelivery.objects.filter(sms_status=SMS_QUEUED, sms_sent=False)
+    expired = queued.filter(created_at__lt=cutoff).update(sms_status=SMS_EXPIRED, updated_at=timezone.now())
+    if expired:
+        print(f"Bulk SMS: {expired} queued messages expired without being submitted", flush=True)
+
+    messages = {}
+    for row in queued.filter(created_at__gte=cutoff).exclude(sms_message_id=None).order_by('id'):
+        message = messages.setdefault(row.sms_message_id, {'phone_number': row.phone_number, 'order_numbers': []})
+        message['order_numbers'].append(row.order_number)
+
+    if SHARDING_ENABLED:
+        partitions = owned_partitions(live_workers())
+        messages = {
+            message_id: message for message_id, message in messages.items()
+            if partition_of(min(message['order_numbers'])) in partitions
+        }
+
+    if not messages:
+        return
+
+    print(f"Bulk SMS: retrying {len(messages)} queued messages", flush=True)
+    sms_outbox = []
+    for message_id, message in messages.items():
+        _, text = build_message(message['order_numbers'])
+        sms_outbox.append({'phone_number': message['phone_number'], 'message': text, 'message_id': message_id})
+    send_sms_outbox(sms_outbox)
+
+def send_pending_cc_digest():
+    """
+    Sends CC_EMAILS one digest of all notifications not yet reported to them.
+    With CC_DIGEST_INTERVAL_MINUTES set, waits until the oldest pending notification
+    is at least that old so that internal recipients get at most one digest per interval.
+    """
+    if not CC_EMAILS:
+        # Nobody to send the digest to, so there is nothing to catch up on later either
+        NotifiedDelivery.objects.filter(cc_digested=False).update(cc_digested=True)
+        return
+
+    pending = list(NotifiedDelivery.objects.filter(cc_digested=False).order_by('created_at'))
+    if not pending:
+        return
+
+    if CC_DIGEST_INTERVAL_MINUTES:
+        due_at = pending[0].created_at + timedelta(minutes=CC_DIGEST_INTERVAL_MINUTES)
+        if timezone.now() < due_at:
+            return
+
+    try:
+        sent = send_cc_digest(pending)
+    except CircuitOpenError as e:
+        print(f"[Email ERROR] {e}", flush=True)
+        sent = False
+
+    if sent:
+        NotifiedDelivery.objects.filter(pk__in=[d.pk for d in pending]).update(cc_digested=True)
+        print(f"CC digest sent for {len(pending)} notifications", flush=True)
+    else:
+        print(f"CC digest for {len(pending)} notifications failed, will retry next run", flush=True)
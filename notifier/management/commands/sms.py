@@ -1,9 +1,16 @@
 import requests
 import base64
+import threading
 import time
 import uuid
-from datetime import datetime
-from decouple import config
+from datetime import datetime, timedelta
+from decouple import config, Csv
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from notifier.models import SmsAccessToken
+from notifier.phone_numbers import normalize_phone_number
+from notifier.circuit_breaker import CircuitOpenError, get_breaker
 
 # Load configuration from .env
 SMS_OAUTH_URL = config("SMS_OAUTH_URL")  # URL for token generation (using GET)
@@ -11,22 +18,149 @@ SMS_SEND_URL = config("SMS_SEND_URL")    # URL for sending SMS
 Username = config("SMS_API_KEY")         # API key
 Password = config("CLIENT_KEY")          # Client key
 SMS_SENDER_ID = config("SMS_SENDER_ID")  # Sender ID for SMS
+# Delivery reports are posted here, e.g. https://host/sms/delivery-report/?token=...
+SMS_CALLBACK_URL = config("SMS_CALLBACK_URL", default="https://your-callback-url.com/")
+SMS_TIMEOUT_SECONDS = config("SMS_TIMEOUT_SECONDS", default=30, cast=int)
+# Bulk submission: a run's SMS are sent in batches of SMS_BATCH_SIZE to SMS_BULK_SEND_URL
+SMS_BULK_MODE = config("SMS_BULK_MODE", default=False, cast=bool)
+SMS_BULK_SEND_URL = config("SMS_BULK_SEND_URL", default="")
+SMS_BATCH_SIZE = config("SMS_BATCH_SIZE", default=100, cast=int)
+SMS_BULK_SUCCESS_STATUSES = [
+    status.lower() for status in
+    config("SMS_BULK_SUCCESS_STATUSES", default="200,success,accepted,queued,sent", cast=Csv())
+]
+# Result of a bulk send for a message the gateway may or may not have accepted
+# (read timeout, server error, missing from the response); left to delivery reports
+SMS_BULK_UNKNOWN = "unknown"
+# The shared token is renewed in the background this long before it expires
+SMS_TOKEN_REFRESH_MARGIN_SECONDS = config("SMS_TOKEN_REFRESH_MARGIN_SECONDS", default=300, cast=int)
 
-cached_sms_token = None
-token_expiry = 0
+# Token requests and sends share one breaker since both go to the same gateway
+sms_breaker = get_breaker("sms")
 
-def get_sms_access_token():
+SMS_TOKEN_NAME = "sms"
+
+
+class SmsTokenManager:
     """
-    Fetches a new access token from the SMS API using Basic Authentication.
+    Shares the SMS access token between processes through the SmsAccessToken table
+    and renews it in a background thread before it expires, so sends never wait for
+    the OAuth round trip. Only one caller at a time fetches a token: threads of this
+    process wait on a lock and other processes wait for the holder of the refresh lease.
+    Sends only ever wait when there is no valid token at all.
+    """
+
+    def __init__(self, refresh_margin=SMS_TOKEN_REFRESH_MARGIN_SECONDS):
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._token = None
+        self._expires_at = None
+        self._lock = threading.Lock()
+        self._refresher_lock = threading.Lock()
+        self._refresher = None
+
+    def get_token(self):
+        token = self._cached_token() or self._load_shared_token()
+        if not token:
+            with self._lock:
+                # Another thread may have refreshed the token while we waited for the lock
+                token = self._cached_token() or self._load_shared_token() or self._refresh()
+
+        if token:
+            self._start_refresher()
+        return token
+
+    def _cached_token(self):
+        if self._token and timezone.now() < self._expires_at:
+            return self._token
+        return None
+
+    def _load_shared_token(self, min_expiry=None):
+        record = SmsAccessToken.objects.filter(
+            name=SMS_TOKEN_NAME, expires_at__gt=min_expiry or timezone.now()
+        ).exclude(token='').first()
+        if record is None:
+            return None
+        self._token, self._expires_at = record.token, record.expires_at
+        return self._token
+
+    def _refresh(self):
+        """
+        Fetches a new token if this process gets the refresh lease, otherwise waits
+        for the process holding it to store a new token. If the holder gives up the
+        lease without one, the lease is taken over and the token fetched here.
+        """
+        deadline = timezone.now() + timedelta(seconds=SMS_TIMEOUT_SECONDS * 2)
+        SmsAccessToken.objects.get_or_create(name=SMS_TOKEN_NAME, defaults={'expires_at': timezone.now()})
+
+        waiting = False
+        while True:
+            now = timezone.now()
+            if waiting:
+                token = self._load_shared_token(min_expiry=now + self.refresh_margin)
+                if token:
+                    return token
+            got_lease = SmsAccessToken.objects.filter(
+                Q(refresh_lease_until__isnull=True) | Q(refresh_lease_until__lt=now), name=SMS_TOKEN_NAME
+            ).update(refresh_lease_until=now + timedelta(seconds=SMS_TIMEOUT_SECONDS * 2))
+            if got_lease:
+                break
+            if now >= deadline:
+                return self._cached_token()
+            if not waiting:
+                print("[SMS] Token refresh in progress in another process, waiting for it.")
+                waiting = True
+            time.sleep(0.5)
+
+        token, expires_in = request_sms_access_token()
+        if not token:
+            SmsAccessToken.objects.filter(name=SMS_TOKEN_NAME).update(refresh_lease_until=None)
+            return self._cached_token()
+
+        expires_at = timezone.now() + timedelta(seconds=int(expires_in) - 60)
+        SmsAccessToken.objects.filter(name=SMS_TOKEN_NAME).update(
+            token=token, expires_at=expires_at, refresh_lease_until=None, updated_at=timezone.now()
+        )
+        self._token, self._expires_at = token, expires_at
+        return token
+
+    def _start_refresher(self):
+        if self._refresher is not None:
+            return
+        with self._refresher_lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name="sms-token-refresher", daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            wait = 60
+            if self._expires_at:
+                wait = max((self._expires_at - self.refresh_margin - timezone.now()).total_seconds(), 30)
+            time.sleep(wait)
+
+            # No local lock here: senders keep using the cached token meanwhile,
+            # and the refresh lease stops them from fetching a second one
+            try:
+                if not self._load_shared_token(min_expiry=timezone.now() + self.refresh_margin):
+                    self._refresh()
+            except Exception as e:
+                print(f"[SMS ERROR] Background token refresh failed: {e}")
+            finally:
+                connections.close_all()
+
+
+token_manager = SmsTokenManager()
+
+def request_sms_access_token():
+    """
+    Requests a new access token from the SMS API using Basic Authentication.
     
     Returns:
-        str: The access token, or None if an error occurs.
+        tuple: The access token and its lifetime in seconds, or (None, 0) if an error occurs.
     """
-    global cached_sms_token, token_expiry
-
-    if cached_sms_token and time.time() < token_expiry:
-        print("[SMS] Access token (cached) still valid.")
-        return cached_sms_token
+    if not sms_breaker.allow_request():
+        print("[SMS ERROR] SMS circuit open, not requesting a token.")
+        return None, 0
 
     credentials = f"{Username}:{Password}"
     encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
@@ -38,9 +172,9 @@ def get_sms_access_token():
 
     try:
         print("[SMS] Requesting new access token via GET...")
-        response = requests.get(SMS_OAUTH_URL, headers=headers)  # Changed to GET request for token
+        response = requests.get(SMS_OAUTH_URL, headers=headers, timeout=SMS_TIMEOUT_SECONDS)  # Changed to GET request for token
 
-        print(f"[SMS] Token response: {response.status_code} - {response.text}")
+        print(f"[SMS] Token response: {response.status_code}")
         response.raise_for_status()
 
         data = response.json()
@@ -48,25 +182,34 @@ def get_sms_access_token():
         expires_in = data.get('expiresIn', 3599)
 
         if not token:
+            sms_breaker.record_failure()
             print("[SMS ERROR] No access_token in response.")
-            return None
+            return None, 0
 
-        cached_sms_token = token
-        token_expiry = time.time() + int(expires_in) - 60  
+        sms_breaker.record_success()
         print(f"[SMS] New token acquired. Expires in {expires_in} seconds.")
-        return token
+        return token, expires_in
 
     except requests.exceptions.RequestException as e:
+        sms_breaker.record_failure()
         print(f"[SMS ERROR] HTTP error while getting token: {e}")
-        if e.response:
-            print(f"[SMS ERROR] Token error response: {e.response.text}")
-        return None
+        return None, 0
     except Exception as e:
+        sms_breaker.record_failure()
         print(f"[SMS ERROR] Unexpected error getting token: {e}")
-        return None
+        return None, 0
 
+def get_sms_access_token():
+    """
+    Returns a valid SMS access token from the shared token cache.
+    
+    Returns:
+        str: The access token, or None if an error occurs.
+    """
+    return token_manager.get_token()
 
-def send_sms(phone_number, message, schedule_time=None):
+
+def send_sms(phone_number, message, schedule_time=None, message_id=None):
     """
     Sends an SMS using the obtained access token.
     
@@ -74,12 +217,24 @@ def send_sms(phone_number, message, schedule_time=None):
         phone_number (str): The phone number to send the SMS to.
         message (str): The message content.
         schedule_time (str, optional): The time at which to send the SMS (in ISO 8601 format).
+        message_id (str, optional): The id delivery reports will refer to. Generated if not given.
         
     Returns:
         bool: True if SMS was sent successfully, False otherwise.
+
+    Raises:
+        CircuitOpenError: If the SMS circuit is open and nothing was attempted.
     """
+    normalized_number = normalize_phone_number(phone_number)
+    if not normalized_number:
+        print(f"[SMS ERROR] Not sending to invalid phone number: {phone_number}")
+        return False
+    phone_number = normalized_number
+
     token = get_sms_access_token()
     if not token:
+        if sms_breaker.is_open():
+            raise CircuitOpenError(f"SMS circuit open, no token to send to {phone_number}")
         print("[SMS ERROR] Unable to send SMS: No valid token.")
         return False
 
@@ -88,10 +243,8 @@ def send_sms(phone_number, message, schedule_time=None):
         'Content-Type': 'application/json',
     }
 
-    message_id = str(uuid.uuid4()) 
-
-    if not phone_number.startswith("+"):
-        phone_number = "254" + phone_number.lstrip("0")  
+    if not message_id:
+        message_id = str(uuid.uuid4())
 
     if not schedule_time:
         schedule_time = datetime.now().strftime('%Y-%m-%dT%H:%M:%S') 
@@ -103,13 +256,22 @@ def send_sms(phone_number, message, schedule_time=None):
         "messageId": message_id,  
         "sendOption": "NOW" ,  
         "description": "Dispatch Notification", 
-        "callBackUrl": "https://your-callback-url.com/",  
+        "callBackUrl": SMS_CALLBACK_URL,
         "scheduleTime": schedule_time,  
     }
 
+    if not sms_breaker.allow_request():
+        raise CircuitOpenError(f"SMS circuit open, not sending to {phone_number}")
+
+    response = None
     try:
         print(f"[SMS] Sending message to {phone_number}: {message} at {schedule_time}")
-        response = requests.post(SMS_SEND_URL, json=payload, headers=headers)
+        response = requests.post(SMS_SEND_URL, json=payload, headers=headers, timeout=SMS_TIMEOUT_SECONDS)
+        # A rejected message (4xx) does not mean the gateway is down
+        if response.status_code >= 500:
+            sms_breaker.record_failure()
+        else:
+            sms_breaker.record_success()
         print(f"[SMS] Send response: {response.status_code} - {response.text}")
         response.raise_for_status()
 
@@ -122,11 +284,152 @@ def send_sms(phone_number, message, schedule_time=None):
             return False
 
     except requests.exceptions.RequestException as e:
+        if response is None:
+            sms_breaker.record_failure()
         print(f"[SMS ERROR] HTTP error sending SMS: {e}")
         if e.response:
             print(f"[SMS ERROR] Response: {e.response.text}")
         return False
     except Exception as e:
+        if response is None:
+            sms_breaker.record_failure()
         print(f"[SMS ERROR] Unexpected error: {e}")
         return False
 
+
+def is_bulk_success_status(entry):
+    if 'success' in entry:
+        return bool(entry['success'])
+    status = str(entry.get('status') or entry.get('statusCode') or '').lower()
+    return status in SMS_BULK_SUCCESS_STATUSES
+
+
+def parse_bulk_sms_results(data, message_ids):
+    """
+    Maps a bulk send response back to the submitted message ids. If the gateway
+    only acknowledges the batch as a whole, its top-level status applies to every
+    message of it; a response that is neither counts as a failure.
+    Messages missing from a per-message response may still have been accepted.
+
+    Returns:
+        dict: message id -> True if the gateway accepted that message, False if it
+        rejected it, or SMS_BULK_UNKNOWN if the response does not say.
+    """
+    entries = data
+    if isinstance(data, dict):
+        entries = data.get('messages') or data.get('results') or data.get('data')
+    entries = [entry for entry in entries if isinstance(entry, dict)] if isinstance(entries, list) else []
+
+    if not entries:
+        accepted = isinstance(data, dict) and is_bulk_success_status(data)
+        if not accepted:
+            print(f"[SMS ERROR] Unrecognized bulk send response: {data}")
+        return {message_id: accepted for message_id in message_ids}
+
+    results = {message_id: SMS_BULK_UNKNOWN for message_id in message_ids}
+    for entry in entries:
+        message_id = entry.get('messageId')
+        if message_id in results:
+            results[message_id] = is_bulk_success_status(entry)
+    return results
+
+
+def send_bulk_sms(messages, schedule_time=None):
+    """
+    Sends many SMS with one request per batch of SMS_BATCH_SIZE messages.
+
+    Args:
+        messages (list): Dicts with 'phone_number', 'message' and 'message_id'.
+        schedule_time (str, optional): The time at which to send the SMS (in ISO 8601 format).
+
+    Returns:
+        dict: message id -> True if the SMS was accepted by the gateway, False if it was
+        rejected, None if it was never submitted (no token, open circuit, no connection)
+        and should be tried again later, or SMS_BULK_UNKNOWN if the gateway may have
+        received it (read timeout, server error) so that sending it again could duplicate it.
+    """
+    results = {}
+
+    valid = []
+    for m in messages:
+        phone_number = normalize_phone_number(m['phone_number'])
+        if phone_number:
+            valid.append({**m, 'phone_number': phone_number})
+            results[m['message_id']] = None
+        else:
+            results[m['message_id']] = False
+            print(f"[SMS ERROR] Not sending to invalid phone number: {m['phone_number']}")
+
+    if not schedule_time:
+        schedule_time = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+    for i in range(0, len(valid), SMS_BATCH_SIZE):
+        batch = valid[i:i + SMS_BATCH_SIZE]
+        message_ids = [m['message_id'] for m in batch]
+
+        token = get_sms_access_token()
+        if not token:
+            print(f"[SMS ERROR] Unable to send batch of {len(batch)} SMS: No valid token.")
+            continue
+
+        if not sms_breaker.allow_request():
+            print(f"[SMS ERROR] SMS circuit open, not sending batch of {len(batch)} SMS")
+            continue
+
+        headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json',
+        }
+        payload = {
+            "senderId": SMS_SENDER_ID,
+            "sendOption": "NOW",
+            "description": "Dispatch Notification",
+            "callBackUrl": SMS_CALLBACK_URL,
+            "scheduleTime": schedule_time,
+            "messages": [
+                {"phoneNumber": m['phone_number'], "message": m['message'], "messageId": m['message_id']}
+                for m in batch
+            ],
+        }
+
+        response = None
+        try:
+            print(f"[SMS] Sending batch of {len(batch)} messages")
+            response = requests.post(SMS_BULK_SEND_URL, json=payload, headers=headers, timeout=SMS_TIMEOUT_SECONDS)
+            if response.status_code >= 500:
+                sms_breaker.record_failure()
+            else:
+                sms_breaker.record_success()
+            print(f"[SMS] Batch send response: {response.status_code}")
+            response.raise_for_status()
+
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            batch_results = parse_bulk_sms_results(data, message_ids)
+            results.update(batch_results)
+            accepted = sum(1 for result in batch_results.values() if result is True)
+            print(f"[SMS SUCCESS] {accepted}/{len(batch)} messages of batch accepted")
+
+        except requests.exceptions.ConnectionError as e:
+            # Also covers ConnectTimeout: the batch never reached the gateway and stays queued
+            sms_breaker.record_failure()
+            print(f"[SMS ERROR] Could not connect to send SMS batch: {e}")
+        except requests.exceptions.RequestException as e:
+            if response is None:
+                sms_breaker.record_failure()
+            if response is not None and response.status_code < 500:
+                # The gateway rejected the batch, sending it again would not help
+                results.update({message_id: False for message_id in message_ids})
+            else:
+                results.update({message_id: SMS_BULK_UNKNOWN for message_id in message_ids})
+            print(f"[SMS ERROR] HTTP error sending SMS batch: {e}")
+        except Exception as e:
+            if response is None:
+                sms_breaker.record_failure()
+            else:
+                results.update({message_id: SMS_BULK_UNKNOWN for message_id in message_ids})
+            print(f"[SMS ERROR] Unexpected error sending SMS batch: {e}")
+
+    return results
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+
+def mark_existing_as_digested(apps, schema_editor):
+    # Existing rows were already copied to CC_EMAILS per message
+    NotifiedDelivery = apps.get_model('notifier', 'NotifiedDelivery')
+    NotifiedDelivery.objects.update(cc_digested=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifier', '0005_rename_notified_at_notifieddelivery_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notifieddelivery',
+            name='cc_digested',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_existing_as_digested, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifier', '0006_notifieddelivery_cc_digested'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notifieddelivery',
+            name='sms_message_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='notifieddelivery',
+            name='sms_status',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='notifieddelivery',
+            name='sms_status_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifier', '0007_notifieddelivery_sms_message_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_number', models.CharField(max_length=50, unique=True)),
+                ('worker_id', models.CharField(max_length=100)),
+                ('claimed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkerNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('worker_id', models.CharField(max_length=100, unique=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('last_heartbeat', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifier', '0008_deliveryclaim_workernode'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notifieddelivery',
+            name='product_code',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+        migrations.CreateModel(
+            name='NotifiedDeliveryLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.PositiveIntegerField()),
+                ('product_code', models.CharField(blank=True, db_index=True, max_length=50, null=True)),
+                ('spec', models.CharField(blank=True, max_length=255, null=True)),
+                ('quantity_ordered', models.IntegerField(default=0)),
+                ('unit', models.CharField(blank=True, max_length=20, null=True)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('base_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('delivery', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='notifier.notifieddelivery')),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifier', '0009_notifieddeliveryline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsAccessToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('token', models.TextField(blank=True)),
+                ('expires_at', models.DateTimeField()),
+                ('refresh_lease_until', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifier', '0010_smsaccesstoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notifieddelivery',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
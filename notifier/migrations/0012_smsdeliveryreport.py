@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifier', '0011_notifieddelivery_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsDeliveryReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(max_length=64)),
+                ('status', models.CharField(max_length=50)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -12,7 +12,7 @@ class NotifiedDelivery(models.Model):
     reg_date = models.DateField(blank=True, null=True)
     reg_time = models.TimeField(blank=True, null=True)
     spec = models.CharField(max_length=255, blank=True, null=True)
-    product_code = models.CharField(max_length=50, blank=True, null=True)
+    product_code = models.CharField(max_length=50, blank=True, null=True, db_index=True)
     quantity_ordered = models.IntegerField(default=0)
     unit = models.CharField(max_length=20, blank=True, null=True)
     price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
@@ -22,8 +22,65 @@ class NotifiedDelivery(models.Model):
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     email_sent = models.BooleanField(default=False)
     sms_sent = models.BooleanField(default=False)
+    sms_message_id = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    sms_status = models.CharField(max_length=50, blank=True, null=True)
+    sms_status_updated_at = models.DateTimeField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
+    cc_digested = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Order {self.order_number} - {self.customer_name}"
+
+
+class NotifiedDeliveryLine(models.Model):
+    delivery = models.ForeignKey(NotifiedDelivery, on_delete=models.CASCADE, related_name='lines')
+    line_number = models.PositiveIntegerField()
+    product_code = models.CharField(max_length=50, blank=True, null=True, db_index=True)
+    spec = models.CharField(max_length=255, blank=True, null=True)
+    quantity_ordered = models.IntegerField(default=0)
+    unit = models.CharField(max_length=20, blank=True, null=True)
+    price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    base_price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+
+    def __str__(self):
+        return f"Order {self.delivery.order_number} line {self.line_number} - {self.product_code}"
+
+
+class WorkerNode(models.Model):
+    worker_id = models.CharField(max_length=100, unique=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    last_heartbeat = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Worker {self.worker_id}"
+
+
+class DeliveryClaim(models.Model):
+    order_number = models.CharField(max_length=50, unique=True)
+    worker_id = models.CharField(max_length=100)
+    claimed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Order {self.order_number} - {self.worker_id}"
+
+
+class SmsAccessToken(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    token = models.TextField(blank=True)
+    expires_at = models.DateTimeField()
+    refresh_lease_until = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} token (expires {self.expires_at})"
+
+
+class SmsDeliveryReport(models.Model):
+    message_id = models.CharField(max_length=64)
+    status = models.CharField(max_length=50)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.message_id} - {self.status}"
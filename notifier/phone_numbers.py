@@ -0,0 +1,75 @@
+import re
+from decouple import config
+
+SMS_DEFAULT_COUNTRY_CODE = config("SMS_DEFAULT_COUNTRY_CODE", default="254")
+# Numbers that can receive SMS, as digits including the country code (Kenyan mobiles by default)
+SMS_MOBILE_PATTERN = re.compile(config("SMS_MOBILE_PATTERN", default=r"^254(7\d{8}|1\d{8})$"))
+
+# Results are cached by the raw value, so each distinct number is only parsed once per process
+_normalized_numbers = {}
+_invalid_numbers = set()
+
+
+def normalize_phone_number(raw):
+    """
+    Converts a phone number as typed in Hansa to E.164 digits without the leading '+'
+    (e.g. '0712 345 678' -> '254712345678').
+
+    Returns:
+        str: The normalized number, or None if it is not a valid mobile number.
+    """
+    if raw is None:
+        return None
+    key = str(raw).strip()
+    if key in _normalized_numbers:
+        return _normalized_numbers[key]
+    if key in _invalid_numbers or not key:
+        return None
+
+    number = re.sub(r"[\s\-().]", "", key)
+    if number.startswith("+"):
+        number = number[1:]
+    elif number.startswith("00"):
+        number = number[2:]
+    elif number.startswith("0"):
+        number = SMS_DEFAULT_COUNTRY_CODE + number[1:]
+    elif not number.startswith(SMS_DEFAULT_COUNTRY_CODE):
+        number = SMS_DEFAULT_COUNTRY_CODE + number
+
+    if not number.isdigit() or not SMS_MOBILE_PATTERN.match(number):
+        _invalid_numbers.add(key)
+        return None
+
+    _normalized_numbers[key] = number
+    return number
+
+
+def build_customer_directory(customers_data):
+    """
+    Maps each customer email to the first valid mobile number among Phone, Mobile and AltPhone.
+
+    Returns:
+        dict: Lower-cased email -> normalized phone number, or None if the customer has no valid mobile.
+    """
+    if isinstance(customers_data, dict):
+        customers_data = [customers_data]
+
+    directory = {}
+    invalid = 0
+    for customer in customers_data:
+        email = str(customer.get('eMail') or '').strip().lower()
+        if not email or email in directory:
+            continue
+
+        raw_numbers = [customer.get(field) for field in ('Phone', 'Mobile', 'AltPhone') if customer.get(field)]
+        phone = next((p for p in map(normalize_phone_number, raw_numbers) if p), None)
+        if raw_numbers and not phone:
+            invalid += 1
+        directory[email] = phone
+
+    print(
+        f"Customer directory loaded: {len(directory)} customers, "
+        f"{sum(1 for p in directory.values() if p)} with a valid mobile, {invalid} with only invalid numbers",
+        flush=True,
+    )
+    return directory
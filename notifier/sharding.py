@@ -0,0 +1,123 @@
+import os
+import socket
+import zlib
+from datetime import timedelta
+from decouple import config
+from django.utils import timezone
+from notifier.models import DeliveryClaim, NotifiedDelivery, WorkerNode
+
+# Split deliveries across all live workers sharing this database
+SHARDING_ENABLED = config("SHARDING_ENABLED", default=False, cast=bool)
+SHARD_PARTITIONS = config("SHARD_PARTITIONS", default=64, cast=int)
+WORKER_ID = config("WORKER_ID", default=f"{socket.gethostname()}:{os.getpid()}")
+WORKER_HEARTBEAT_SECONDS = config("WORKER_HEARTBEAT_SECONDS", default=30, cast=int)
+WORKER_TIMEOUT_SECONDS = config("WORKER_TIMEOUT_SECONDS", default=120, cast=int)
+# Claims of recorded orders are kept this long so that a worker with an older view of the
+# notifications table still finds them, then they are removed
+CLAIM_RETENTION_HOURS = config("CLAIM_RETENTION_HOURS", default=24, cast=int)
+
+
+def heartbeat():
+    """
+    Records that this worker is alive and removes workers that stopped sending heartbeats.
+    """
+    now = timezone.now()
+    WorkerNode.objects.update_or_create(worker_id=WORKER_ID, defaults={'last_heartbeat': now})
+
+    dead, _ = WorkerNode.objects.filter(last_heartbeat__lt=now - timedelta(seconds=WORKER_TIMEOUT_SECONDS)).delete()
+    if dead:
+        print(f"[Sharding] Removed {dead} dead workers, partitions will be rebalanced", flush=True)
+
+    purge_recorded_claims()
+
+
+def purge_recorded_claims():
+    cutoff = timezone.now() - timedelta(hours=CLAIM_RETENTION_HOURS)
+    DeliveryClaim.objects.filter(
+        claimed_at__lt=cutoff,
+        order_number__in=NotifiedDelivery.objects.values('order_number'),
+    ).delete()
+
+
+def live_workers():
+    return sorted(WorkerNode.objects.values_list('worker_id', flat=True))
+
+
+def is_leader():
+    """
+    The live worker with the lowest id runs the jobs that must only run once across all workers.
+    """
+    workers = live_workers()
+    return bool(workers) and workers[0] == WORKER_ID
+
+
+def partition_of(order_number):
+    # crc32 rather than hash() so that every process maps an order to the same partition
+    return zlib.crc32(str(order_number).encode('utf-8')) % SHARD_PARTITIONS
+
+
+def owned_partitions(workers):
+    if WORKER_ID not in workers:
+        return set()
+    index = workers.index(WORKER_ID)
+    return {p for p in range(SHARD_PARTITIONS) if p % len(workers) == index}
+
+
+def select_owned_deliveries(deliveries):
+    """
+    Keeps only the deliveries whose partition is assigned to this worker.
+    Partitions are spread round-robin over the sorted list of live workers,
+    so they are rebalanced as soon as a worker joins or times out.
+    """
+    heartbeat()
+    workers = live_workers()
+    partitions = owned_partitions(workers)
+
+    owned = [d for d in deliveries if partition_of(d.get('SerNr', 'N/A')) in partitions]
+    print(
+        f"[Sharding] Worker {WORKER_ID} owns {len(partitions)}/{SHARD_PARTITIONS} partitions "
+        f"({len(workers)} live workers), {len(owned)}/{len(deliveries)} deliveries",
+        flush=True,
+    )
+    return owned
+
+
+def claim_pending_deliveries(pending):
+    """
+    Claims the pending deliveries for this worker in the shared DeliveryClaim table.
+    While partitions are being rebalanced two workers may both see an order as theirs;
+    the unique claim makes sure only one of them notifies it.
+
+    Returns:
+        list: The pending entries this worker holds the claim for.
+    """
+    order_numbers = [entry['order_number'] for entry in pending]
+    if not order_numbers:
+        return []
+
+    DeliveryClaim.objects.bulk_create(
+        [DeliveryClaim(order_number=n, worker_id=WORKER_ID) for n in order_numbers],
+        ignore_conflicts=True,
+    )
+
+    # Take over claims left behind by workers that died before notifying
+    DeliveryClaim.objects.filter(order_number__in=order_numbers).exclude(
+        worker_id__in=live_workers()
+    ).update(worker_id=WORKER_ID)
+
+    claimed = set(
+        DeliveryClaim.objects.filter(order_number__in=order_numbers, worker_id=WORKER_ID)
+        .values_list('order_number', flat=True)
+    )
+    skipped = len(order_numbers) - len(claimed)
+    if skipped:
+        print(f"[Sharding] {skipped} deliveries already claimed by other workers, skipping.", flush=True)
+    return [entry for entry in pending if entry['order_number'] in claimed]
+
+
+def release_claims(order_numbers):
+    """
+    Gives up this worker's claims on orders it did not record, so that whichever worker
+    owns their partition by the next run can pick them up.
+    """
+    DeliveryClaim.objects.filter(order_number__in=order_numbers, worker_id=WORKER_ID).delete()
@@ -1,3 +1,492 @@
+import asyncio
+import json
+import os
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from notifier import delivery_reports, live_updates, phone_numbers, sharding
+from notifier.circuit_breaker import CircuitBreaker, CircuitOpenError
+from notifier.models import (
+    DeliveryClaim, NotifiedDelivery, NotifiedDeliveryLine, SmsAccessToken, SmsDeliveryReport, WorkerNode,
+)
+
+# The notification commands read their gateway settings at import time
+for name, value in {
+    'HANSA_API_URL': 'http://hansa.test/deliveries', 'HANSA_GET_CUSTOMER_API_URL': 'http://hansa.test/customers',
+    'HANSA_USERNAME': 'test', 'HANSA_PASSWORD': 'test', 'CONTACT_PHONE': '0700000000',
+    'SMS_OAUTH_URL': 'http://sms.test/token', 'SMS_SEND_URL': 'http://sms.test/send', 'SMS_API_KEY': 'test',
+    'CLIENT_KEY': 'test', 'SMS_SENDER_ID': 'TEST', 'EMAIL_HOST': 'localhost', 'EMAIL_PORT': '25',
+    'EMAIL_USE_TLS': 'False', 'EMAIL_HOST_USER': 'test', 'EMAIL_HOST_PASSWORD': 'test',
+    'FROM_EMAIL': 'dispatch@example.com', 'CC_EMAILS': '',
+}.items():
+    os.environ.setdefault(name, value)
+
+import requests  # noqa: E402
+from notifier.management.commands import send_dispatch_notifications as dispatch  # noqa: E402
+from notifier.management.commands import sms  # noqa: E402
+
+
+class DeliveryClaimTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        WorkerNode.objects.create(worker_id='worker-a', last_heartbeat=now)
+        WorkerNode.objects.create(worker_id='worker-b', last_heartbeat=now)
+
+    def claim_as(self, worker_id, order_numbers):
+        with mock.patch.object(sharding, 'WORKER_ID', worker_id):
+            pending = [{'order_number': n} for n in order_numbers]
+            return [entry['order_number'] for entry in sharding.claim_pending_deliveries(pending)]
+
+    def test_claimed_order_is_skipped_by_other_live_worker(self):
+        self.assertEqual(self.claim_as('worker-a', ['1', '2']), ['1', '2'])
+        self.assertEqual(self.claim_as('worker-b', ['2', '3']), ['3'])
+
+    def test_claim_of_dead_worker_is_taken_over(self):
+        self.claim_as('worker-a', ['1'])
+        WorkerNode.objects.filter(worker_id='worker-a').delete()
+
+        self.assertEqual(self.claim_as('worker-b', ['1']), ['1'])
+        self.assertEqual(DeliveryClaim.objects.get(order_number='1').worker_id, 'worker-b')
+
+    def test_released_claim_can_be_taken_by_live_worker(self):
+        self.claim_as('worker-a', ['1'])
+        with mock.patch.object(sharding, 'WORKER_ID', 'worker-a'):
+            sharding.release_claims(['1'])
+
+        self.assertEqual(self.claim_as('worker-b', ['1']), ['1'])
+
+    def test_old_claims_of_recorded_orders_are_purged(self):
+        self.claim_as('worker-a', ['1', '2'])
+        NotifiedDelivery.objects.create(order_number='1')
+        DeliveryClaim.objects.update(claimed_at=timezone.now() - timedelta(hours=sharding.CLAIM_RETENTION_HOURS + 1))
+
+        sharding.purge_recorded_claims()
+
+        self.assertEqual(list(DeliveryClaim.objects.values_list('order_number', flat=True)), ['2'])
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('notifier.circuit_breaker.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_threshold=3, recovery_timeout=60)
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow_request())
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(self.breaker.is_open())
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_a_single_probe(self):
+        self.open_breaker()
+        self.now += 61
+
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertTrue(self.breaker.is_open())
+
+    def test_successful_probe_closes(self):
+        self.open_breaker()
+        self.now += 61
+        self.breaker.allow_request()
+        self.breaker.record_success()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_failed_probe_reopens(self):
+        self.open_breaker()
+        self.now += 61
+        self.breaker.allow_request()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.now += 61
+        self.assertTrue(self.breaker.allow_request())
+
+
+class PhoneNumberTests(TestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(phone_numbers, '_normalized_numbers', {}),
+            mock.patch.object(phone_numbers, '_invalid_numbers', set()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_normalizes_local_and_international_formats(self):
+        for raw in ['0712 345 678', '+254 712-345-678', '254712345678', '712345678', '00254712345678', '(0712) 345678']:
+            self.assertEqual(phone_numbers.normalize_phone_number(raw), '254712345678', raw)
+        self.assertEqual(phone_numbers.normalize_phone_number('0110123456'), '254110123456')
+
+    def test_rejects_landline_foreign_and_malformed_numbers(self):
+        for raw in ['020 1234567', '+441234567890', 'abc', '0712', '', None]:
+            self.assertIsNone(phone_numbers.normalize_phone_number(raw), raw)
+
+    def test_results_are_cached_by_raw_value(self):
+        phone_numbers.normalize_phone_number('0712 345 678')
+        phone_numbers.normalize_phone_number('020 1234567')
+
+        self.assertEqual(phone_numbers._normalized_numbers, {'0712 345 678': '254712345678'})
+        self.assertEqual(phone_numbers._invalid_numbers, {'020 1234567'})
+
+        with mock.patch.object(phone_numbers, 'SMS_MOBILE_PATTERN') as pattern:
+            self.assertEqual(phone_numbers.normalize_phone_number('0712 345 678'), '254712345678')
+            self.assertIsNone(phone_numbers.normalize_phone_number('020 1234567'))
+            pattern.match.assert_not_called()
+
+    def test_directory_picks_first_valid_mobile(self):
+        directory = phone_numbers.build_customer_directory([
+            {'eMail': ' A@Example.com ', 'Phone': '020 1234567', 'Mobile': '0722 000 000', 'AltPhone': '0733 000 000'},
+            {'eMail': 'b@example.com', 'Phone': '123'},
+            {'eMail': 'a@example.com', 'Phone': '0744 000 000'},
+        ])
+
+        self.assertEqual(directory, {'a@example.com': '254722000000', 'b@example.com': None})
+
+
+class LiveUpdatesTests(TestCase):
+    def test_stream_is_not_served_under_wsgi(self):
+        response = self.client.get(reverse('dashboard_stream'))
+        self.assertEqual(response.status_code, 204)
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertNotContains(response, 'EventSource')
+
+    def test_stream_script_is_rendered_when_enabled(self):
+        with mock.patch.object(live_updates, 'LIVE_UPDATES_ENABLED', True):
+            response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, 'EventSource')
+
+    async def test_late_commits_are_sent_once(self):
+        broadcaster = live_updates.DeliveryBroadcaster(poll_interval=0.01, overlap=5)
+        queue = broadcaster.subscribe()
+        # Stamped before the poll watermark but only committed afterwards
+        late = await NotifiedDelivery.objects.acreate(order_number='1')
+        await NotifiedDelivery.objects.filter(pk=late.pk).aupdate(
+            updated_at=broadcaster._last_seen - timedelta(seconds=2)
+        )
+
+        event = await asyncio.wait_for(queue.get(), timeout=1)
+        self.assertEqual(event['order_number'], '1')
+        await asyncio.sleep(0.05)
+        self.assertTrue(queue.empty())
+
+        broadcaster.unsubscribe(queue)
+        await asyncio.wait_for(broadcaster._task, timeout=1)
+
+
+class RecordNotifiedDeliveriesTests(TestCase):
+    def entry(self, order_number, rows):
+        return {
+            'order_number': order_number,
+            'delivery': {'SerNr': order_number, 'Addr0': 'Acme', 'rows': {'row': rows}},
+            'email': 'acme@example.com',
+            'phone': '254712345678',
+        }
+
+    def test_malformed_price_on_a_later_line_does_not_block_recording(self):
+        rows = [
+            {'ArtCode': 'A1', 'Ordered': '2', 'Price': '100.50', 'BasePrice': '90'},
+            {'ArtCode': 'B2', 'Ordered': '1', 'Price': '1,200.00', 'BasePrice': 'n/a'},
+        ]
+
+        dispatch.record_notified_deliveries([self.entry('1001', rows)], email_sent=True, sms_sent=True)
+
+        delivery = NotifiedDelivery.objects.get(order_number='1001')
+        self.assertEqual(delivery.price, Decimal('100.50'))
+        lines = NotifiedDeliveryLine.objects.filter(delivery=delivery).order_by('line_number')
+        self.assertEqual([(line.product_code, line.price, line.base_price) for line in lines], [
+            ('A1', Decimal('100.50'), Decimal('90.00')),
+            ('B2', None, None),
+        ])
+
+    def test_parse_decimal(self):
+        self.assertEqual(dispatch.parse_decimal(' 12.346 '), Decimal('12.35'))
+        for raw in [None, '', '1,200.00', 'NaN', 'Infinity', '1e20']:
+            self.assertIsNone(dispatch.parse_decimal(raw), raw)
+
+
+def outbox(*message_ids):
+    return [{'phone_number': '0712345678', 'message': 'Hi', 'message_id': m} for m in message_ids]
+
+
+class BulkSmsTests(TestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(sms, 'sms_breaker', CircuitBreaker('sms-test')),
+            mock.patch.object(sms, 'get_sms_access_token', return_value='token'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def response(self, status_code, data=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(data).encode()
+        return response
+
+    def test_per_message_results(self):
+        data = {'messages': [{'messageId': 'a', 'status': 'Sent'}, {'messageId': 'b', 'status': 'failed'}]}
+        self.assertEqual(sms.parse_bulk_sms_results(data, ['a', 'b', 'c']), {
+            'a': True, 'b': False, 'c': sms.SMS_BULK_UNKNOWN,
+        })
+
+    def test_batch_results(self):
+        self.assertEqual(sms.parse_bulk_sms_results({'status': '200'}, ['a', 'b']), {'a': True, 'b': True})
+        self.assertEqual(sms.parse_bulk_sms_results({'error': 'x'}, ['a']), {'a': False})
+        self.assertEqual(sms.parse_bulk_sms_results(None, ['a']), {'a': False})
+
+    def test_send_outcomes_by_failure(self):
+        cases = [
+            (requests.exceptions.ConnectTimeout(), None),
+            (requests.exceptions.ConnectionError(), None),
+            (requests.exceptions.ReadTimeout(), sms.SMS_BULK_UNKNOWN),
+            (self.response(503), sms.SMS_BULK_UNKNOWN),
+            (self.response(400), False),
+            (self.response(200, {'status': 'success'}), True),
+        ]
+        for outcome, expected in cases:
+            with mock.patch.object(sms.requests, 'post', side_effect=[outcome]):
+                results = sms.send_bulk_sms(outbox('a'))
+            self.assertEqual(results, {'a': expected}, outcome)
+
+    def test_invalid_number_is_rejected_without_sending(self):
+        with mock.patch.object(sms.requests, 'post') as post:
+            results = sms.send_bulk_sms([{'phone_number': '123', 'message': 'Hi', 'message_id': 'a'}])
+        self.assertEqual(results, {'a': False})
+        post.assert_not_called()
+
+
+class SmsOutboxTests(TestCase):
+    def queue(self, order_number, message_id, created_at=None):
+        delivery = NotifiedDelivery.objects.create(
+            order_number=order_number, phone_number='0712345678', sms_sent=False,
+            sms_message_id=message_id, sms_status=dispatch.SMS_QUEUED,
+        )
+        if created_at:
+            NotifiedDelivery.objects.filter(pk=delivery.pk).update(created_at=created_at)
+        return delivery
+
+    def statuses(self):
+        return dict(NotifiedDelivery.objects.values_list('order_number', 'sms_status'))
+
+    def test_outbox_results_update_deliveries(self):
+        for order_number, message_id in [('1', 'a'), ('2', 'b'), ('3', 'c'), ('4', 'd')]:
+            self.queue(order_number, message_id)
+        results = {'a': True, 'b': False, 'c': sms.SMS_BULK_UNKNOWN, 'd': None}
+
+        with mock.patch.object(dispatch, 'send_bulk_sms', return_value=results):
+            dispatch.send_sms_outbox(outbox('a', 'b', 'c', 'd'))
+
+        self.assertEqual(self.statuses(), {
+            '1': dispatch.SMS_SUBMITTED, '2': dispatch.SMS_REJECTED, '3': dispatch.SMS_UNKNOWN, '4': dispatch.SMS_QUEUED,
+        })
+        self.assertEqual(list(NotifiedDelivery.objects.filter(sms_sent=True).values_list('order_number', flat=True)), ['1'])
+
+    def test_retry_resends_queued_messages_once_per_message_id(self):
+        self.queue('1', 'a')
+        self.queue('2', 'a')
+        self.queue('3', 'b', created_at=timezone.now() - timedelta(hours=dispatch.SMS_RETRY_MAX_AGE_HOURS + 1))
+        NotifiedDelivery.objects.create(order_number='4', sms_message_id='c', sms_status=dispatch.SMS_UNKNOWN)
+
+        with mock.patch.object(dispatch, 'send_bulk_sms', return_value={'a': True}) as send_bulk_sms:
+            dispatch.retry_queued_sms()
+
+        outbox = send_bulk_sms.call_args.args[0]
+        self.assertEqual([(m['message_id'], m['phone_number']) for m in outbox], [('a', '0712345678')])
+        self.assertIn('1', outbox[0]['message'])
+        self.assertIn('2', outbox[0]['message'])
+        self.assertEqual(self.statuses(), {
+            '1': dispatch.SMS_SUBMITTED, '2': dispatch.SMS_SUBMITTED, '3': dispatch.SMS_EXPIRED, '4': dispatch.SMS_UNKNOWN,
+        })
+
+
+class DeliveryReportTests(TestCase):
+    def setUp(self):
+        for patcher in (
+            mock.patch('notifier.views.SMS_CALLBACK_TOKEN', 'secret'),
+            mock.patch.object(delivery_reports, '_pending_count', 0),
+            mock.patch.object(delivery_reports, '_flush_timer', None),
+            mock.patch.object(delivery_reports.threading, 'Timer'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.timer = delivery_reports.threading.Timer
+
+    def post(self, payload, token='secret'):
+        url = reverse('sms_delivery_report') + (f'?token={token}' if token is not None else '')
+        return self.client.post(url, data=json.dumps(payload), content_type='application/json')
+
+    def test_callbacks_without_the_token_are_refused(self):
+        self.assertEqual(self.post({'messageId': 'a', 'status': 'DELIVERED'}, token=None).status_code, 403)
+        self.assertEqual(self.post({'messageId': 'a', 'status': 'DELIVERED'}, token='wrong').status_code, 403)
+        with mock.patch('notifier.views.SMS_CALLBACK_TOKEN', ''):
+            self.assertEqual(self.post({'messageId': 'a', 'status': 'DELIVERED'}, token='').status_code, 403)
+        self.assertFalse(SmsDeliveryReport.objects.exists())
+
+    def test_reports_are_stored_and_applied_in_order(self):
+        NotifiedDelivery.objects.create(order_number='1', sms_message_id='a', sms_status='submitted')
+        NotifiedDelivery.objects.create(order_number='2', sms_message_id='b', sms_status='submitted')
+
+        response = self.post([
+            {'messageId': 'a', 'status': 'SENT'},
+            {'messageId': 'b', 'deliveryStatus': 'FAILED'},
+            {'messageId': 'a', 'status': 'DELIVERED'},
+            {'status': 'DELIVERED'},
+        ])
+
+        self.assertEqual(response.json(), {'received': 3})
+        self.assertEqual(SmsDeliveryReport.objects.count(), 3)
+        self.timer.assert_called_once()
+
+        self.assertEqual(delivery_reports.flush_delivery_reports(), 2)
+        self.assertEqual(dict(NotifiedDelivery.objects.values_list('sms_message_id', 'sms_status')), {
+            'a': 'DELIVERED', 'b': 'FAILED',
+        })
+        self.assertFalse(SmsDeliveryReport.objects.exists())
+
+    def test_full_batch_is_applied_right_away(self):
+        NotifiedDelivery.objects.create(order_number='1', sms_message_id='a')
+
+        with mock.patch.object(delivery_reports, 'DELIVERY_REPORT_BATCH_SIZE', 1):
+            self.post({'messageId': 'a', 'status': 'DELIVERED'})
+
+        self.assertEqual(NotifiedDelivery.objects.get().sms_status, 'DELIVERED')
+        self.assertFalse(SmsDeliveryReport.objects.exists())
+
+
+class SmsTokenManagerTests(TestCase):
+    def setUp(self):
+        self.manager = sms.SmsTokenManager(refresh_margin=300)
+        for patcher in (
+            mock.patch.object(self.manager, '_start_refresher'),
+            mock.patch.object(sms, 'request_sms_access_token', return_value=('fresh', 3600)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.request_token = sms.request_sms_access_token
+
+    def lease_elsewhere(self):
+        SmsAccessToken.objects.create(
+            name=sms.SMS_TOKEN_NAME, expires_at=timezone.now(),
+            refresh_lease_until=timezone.now() + timedelta(seconds=60),
+        )
+
+    def token_record(self):
+        return SmsAccessToken.objects.get(name=sms.SMS_TOKEN_NAME)
+
+    def test_fetches_and_shares_token_under_the_lease(self):
+        self.assertEqual(self.manager.get_token(), 'fresh')
+
+        record = self.token_record()
+        self.assertEqual(record.token, 'fresh')
+        self.assertIsNone(record.refresh_lease_until)
+        self.assertGreater(record.expires_at, timezone.now() + timedelta(minutes=55))
+
+        # Another process picks up the shared token without fetching its own
+        self.assertEqual(sms.SmsTokenManager().get_token(), 'fresh')
+        self.request_token.assert_called_once()
+
+    def test_failed_fetch_releases_the_lease(self):
+        self.request_token.return_value = (None, 0)
+
+        self.assertIsNone(self.manager.get_token())
+        self.assertIsNone(self.token_record().refresh_lease_until)
+
+    def test_waiter_uses_token_stored_by_lease_holder(self):
+        self.lease_elsewhere()
+
+        def holder_stores_token(seconds):
+            SmsAccessToken.objects.update(
+                token='shared', expires_at=timezone.now() + timedelta(hours=1), refresh_lease_until=None
+            )
+
+        with mock.patch.object(sms.time, 'sleep', side_effect=holder_stores_token):
+            self.assertEqual(self.manager.get_token(), 'shared')
+        self.request_token.assert_not_called()
+
+    def test_waiter_takes_over_when_holder_gives_up(self):
+        self.lease_elsewhere()
+
+        def holder_fails(seconds):
+            SmsAccessToken.objects.update(refresh_lease_until=None)
+
+        with mock.patch.object(sms.time, 'sleep', side_effect=holder_fails) as sleep:
+            self.assertEqual(self.manager.get_token(), 'fresh')
+        sleep.assert_called_once()
+        self.request_token.assert_called_once()
+
+    def test_waiter_gives_up_at_its_deadline(self):
+        self.lease_elsewhere()
+
+        with mock.patch.object(sms, 'SMS_TIMEOUT_SECONDS', 0), mock.patch.object(sms.time, 'sleep') as sleep:
+            self.assertIsNone(self.manager.get_token())
+        sleep.assert_not_called()
+        self.request_token.assert_not_called()
+
+
+class NotifyGroupTests(TestCase):
+    def group(self):
+        return [{
+            'order_number': '1001',
+            'delivery': {'SerNr': '1001', 'Addr0': 'Acme'},
+            'email': 'acme@example.com',
+            'phone': '254712345678',
+        }]
+
+    def test_group_is_not_recorded_when_breaker_refuses_the_send(self):
+        with mock.patch.object(dispatch, 'send_email', return_value=True), \
+                mock.patch.object(dispatch, 'send_sms', side_effect=CircuitOpenError('SMS circuit open')):
+            self.assertFalse(dispatch.notify_group(self.group()))
+
+        self.assertFalse(NotifiedDelivery.objects.exists())
+
+    def test_failed_send_is_recorded(self):
+        with mock.patch.object(dispatch, 'send_email', return_value=True), \
+                mock.patch.object(dispatch, 'send_sms', return_value=False):
+            self.assertTrue(dispatch.notify_group(self.group()))
+
+        delivery = NotifiedDelivery.objects.get()
+        self.assertTrue(delivery.email_sent)
+        self.assertFalse(delivery.sms_sent)
+
+    def test_send_sms_raises_while_circuit_is_open(self):
+        breaker = CircuitBreaker('sms-test', failure_threshold=1)
+        breaker.record_failure()
 
-# Create your tests here.
+        with mock.patch.object(sms, 'sms_breaker', breaker), \
+                mock.patch.object(sms, 'get_sms_access_token', return_value='token'), \
+                mock.patch.object(sms.requests, 'post') as post:
+            with self.assertRaises(CircuitOpenError):
+                sms.send_sms('0712345678', 'Hi')
+            with mock.patch.object(sms, 'get_sms_access_token', return_value=None):
+                with self.assertRaises(CircuitOpenError):
+                    sms.send_sms('0712345678', 'Hi')
+        post.assert_not_called()
@@ -3,4 +3,7 @@ from . import views
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
+    path('stream/', views.dashboard_stream, name='dashboard_stream'),
+    path('sms/delivery-report/', views.sms_delivery_report, name='sms_delivery_report'),
+    path('hansa/webhook/', views.hansa_webhook, name='hansa_webhook'),
 ]
@@ -1,13 +1,31 @@
+import asyncio
+import hmac
+import json
+from decouple import config
 from django.shortcuts import render
 from django.core.paginator import Paginator
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from notifier.models import NotifiedDelivery
+from notifier.delivery_reports import SMS_CALLBACK_TOKEN, store_delivery_reports
+from notifier.live_updates import LIVE_UPDATES_KEEPALIVE_SECONDS, broadcaster, live_updates_available
+
+# Shared secret Hansa must send in the X-Webhook-Token header; the webhook is disabled if empty
+HANSA_WEBHOOK_TOKEN = config("HANSA_WEBHOOK_TOKEN", default="")
 
 def dashboard(request):
-    deliveries = NotifiedDelivery.objects.all()
+    # Newest first so that live updates can be added to the top of the first page
+    deliveries = NotifiedDelivery.objects.order_by('-created_at', '-id')
+
+    paginator = Paginator(deliveries, 10)
+    page_number = request.GET.get('page')
+    deliveries_page = paginator.get_page(page_number)
 
     deliveries_context = []
-    for d in deliveries:
+    for d in deliveries_page:
         deliveries_context.append({
+            'id': d.pk,
             'order_number': d.order_number,                   
             'customer_name': d.customer_name or 'Unknown',    
             'dispatch_date': d.dispatch_date,                 
@@ -16,11 +34,86 @@ def dashboard(request):
             'quantity_ordered': getattr(d, 'quantity_ordered', 0), 
             'email_sent': d.email_sent,
             'sms_sent': d.sms_sent,
+            'sms_status': d.sms_status,
             'notes': d.notes,
+            'created_at': d.created_at,
         })
+    deliveries_page.object_list = deliveries_context
 
-    paginator = Paginator(deliveries_context, 10)
-    page_number = request.GET.get('page')
-    deliveries_page = paginator.get_page(page_number)
+    return render(request, 'dashboard.html', {
+        'deliveries': deliveries_page,
+        'live_updates': live_updates_available(request),
+    })
+
+async def dashboard_stream(request):
+    """
+    Server-Sent Events stream of new and changed notifications for the dashboard.
+    Needs to be served through the ASGI application to keep connections open cheaply;
+    elsewhere it answers 204 so that the browser stops reconnecting.
+    """
+    if not live_updates_available(request):
+        return HttpResponse(status=204)
+
+    queue = broadcaster.subscribe()
+
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=LIVE_UPDATES_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: delivery\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@csrf_exempt
+@require_POST
+def sms_delivery_report(request):
+    """
+    Receives delivery reports from the SMS gateway. Accepts a single JSON report
+    or a list of them; reports are stored right away and applied to the notifications in batches.
+    """
+    token = request.GET.get('token', '')
+    if not SMS_CALLBACK_TOKEN or not hmac.compare_digest(token, SMS_CALLBACK_TOKEN):
+        return HttpResponseForbidden()
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid JSON")
+
+    received = []
+    for report in payload if isinstance(payload, list) else [payload]:
+        if not isinstance(report, dict):
+            continue
+        message_id = report.get('messageId')
+        status = report.get('status') or report.get('deliveryStatus')
+        if message_id and status:
+            received.append((str(message_id)[:64], str(status)[:50]))
+
+    store_delivery_reports(received)
+    return JsonResponse({'received': len(received)})
+
+@csrf_exempt
+@require_POST
+def hansa_webhook(request):
+    """
+    Lets Hansa announce new deliveries so that a dispatch run starts right away
+    instead of waiting for the next poll. Calls arriving in a burst share one run.
+    """
+    token = request.headers.get('X-Webhook-Token', '')
+    if not HANSA_WEBHOOK_TOKEN or not hmac.compare_digest(token, HANSA_WEBHOOK_TOKEN):
+        return HttpResponseForbidden()
+
+    from notifier.jobs import request_dispatch_run
 
-    return render(request, 'dashboard.html', {'deliveries': deliveries_page})
+    scheduled = request_dispatch_run()
+    return JsonResponse({'scheduled': scheduled}, status=202)